@@ -1,28 +1,48 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
+from flask.json.provider import DefaultJSONProvider
 from core.graph import ExpenseGraph  # Use your graph
-from core.debt_simplification import DebtSimplification
+from core.debt_simplification import STRATEGIES
 from core.balance_calculation import BalanceGraph
-from core.debt_simplification import DebtSimplification
+from core.compact_balance import CompactBalanceGraph
+from core.money import Money, allocate, currency_code
 from flask_cors import CORS
 from models.group import Group
 from models.user import User
-import utils.receipt_scanner as scanner
+from storage.journal import Journal
+from storage.group_cache import GroupCache
+from storage.json_store import JsonStore
+from storage.ndjson import export_lines, import_lines
+from storage.sqlite_store import SQLiteStore
+import utils.receipt_parser as receipt_parser
+from utils.currency_conversion import RatesUnavailable, rates as exchange_rates
+from utils.ocr_cache import OCRCache
+from utils.ocr_jobs import OCRJobQueue, QueueFull
 from datetime import datetime, timedelta
 from dateutil import parser  # Install with `pip install python-dateutil`
+import atexit
+import base64
+import io
 import os
 import json
-from werkzeug.utils import secure_filename
+import time
 from PIL import Image
 
+class MoneyJSONProvider(DefaultJSONProvider):
+    """Serialize Money amounts as plain numbers."""
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, Money):
+            return float(o)
+        return DefaultJSONProvider.default(o)
+
+
 app = Flask(__name__)
+app.json = MoneyJSONProvider(app)
 CORS(app)
 
-# Configure upload folder and allowed file types
-UPLOAD_FOLDER = './uploads'
+# Allowed file types for uploads; they are processed in memory and never saved
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
-app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-# Ensure the upload folder exists
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
@@ -30,63 +50,68 @@ def allowed_file(filename):
 expense_graph = ExpenseGraph()
 
 DATA_PATH = "data/graph.json"
-
-# Load groups from JSON file or initialize empty groups
-def load_groups():
-    if os.path.exists(DATA_PATH):
-        with open(DATA_PATH, "r") as file:
-            group_data = json.load(file)
-            groups = {name: Group(name, members=[User(member) for member in data["nodes"]])
-                      for name, data in group_data["groups"].items()}
-            for name, data in group_data["groups"].items():
-                # Load transaction edges into the graph
-                for edge in data["edges"]:
-                    groups[name].graph.add_transaction(
-                        edge["from"], edge["to"], edge["amount"], edge["category"], edge["timestamp"], edge["explanation"]
-                    )
-
-                # Load balance graph
-                if "balance_graph" in data:
-                    balance_graph_data = data["balance_graph"]
-                    for edge in balance_graph_data["edges"]:
-                        groups[name].graph.balance_graph.add_edge(
-                            edge["from"], edge["to"], edge["amount"]
-                        )
-            return groups
-    return {}
-
-
-def save_groups(groups):
-    group_data = {
-        "groups": {
-            name: {
-                "nodes": list(set(member.name for member in group.members)),
-                "edges": [
-                    {"from": from_user, "to": transaction["to"], "amount": transaction["amount"],
-                     "category": transaction["category"], "timestamp": transaction["timestamp"], "explanation": transaction["explanation"]}
-                    for from_user, transactions in group.graph.graph.items()
-                    for transaction in transactions
-                ],
-                "balance_graph": {
-                    "nodes": list(set(from_user for from_user in group.graph.balance_graph.graph.keys()) |
-                                  set(to_user for edges in group.graph.balance_graph.graph.values() 
-                                      for to_user in edges.keys())),
-                    "edges": [
-                        {"from": from_user, "to": to_user, "amount": amount}
-                        for from_user, edges in group.graph.balance_graph.graph.items()
-                        for to_user, amount in edges.items()
-                    ]
-                }
-            } for name, group in groups.items()
-        }
-    }
-
-    with open(DATA_PATH, "w") as file:
-        json.dump(group_data, file, indent=4)
-
-
-# Initialize groups
-groups = load_groups()
+JOURNAL_PATH = "data/graph.journal"
+GROUPS_DIR = "data/groups"
+SQLITE_PATH = "data/graph.db"
+
+# Balance graph implementation: "dict" (BalanceGraph) or "compact" (array-backed)
+if os.environ.get("BALANCE_GRAPH") == "compact":
+    ExpenseGraph.balance_graph_cls = CompactBalanceGraph
+
+# Currency of transactions that don't name one; don't change it once there is data
+ExpenseGraph.currency = currency_code(os.environ.get("DEFAULT_CURRENCY", "USD"))
+
+# Storage backend: "json" (one snapshot + journal per group) or "sqlite"
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+
+# Hydrated groups kept in memory; the least recently used ones are evicted
+GROUP_CACHE_CAPACITY = int(os.environ.get("GROUP_CACHE_CAPACITY", 128))
+GROUP_CACHE_MAX_BYTES = int(os.environ.get("GROUP_CACHE_MAX_BYTES", 256 * 1024 * 1024))
+
+
+def create_store():
+    """Create the configured storage backend."""
+    if STORAGE_BACKEND == "sqlite":
+        store = SQLiteStore(SQLITE_PATH)
+        # Migrate the existing JSON data the first time the database is used: the
+        # per-group files if the JSON backend ever split graph.json, else graph.json
+        if not store.list_groups():
+            groups = JsonStore(GROUPS_DIR).load_all() if os.path.isdir(GROUPS_DIR) else {}
+            if not groups and os.path.exists(DATA_PATH):
+                groups = Journal(DATA_PATH, JOURNAL_PATH).load()
+            if groups:
+                store.import_groups(groups)
+        return store
+    if STORAGE_BACKEND == "json":
+        # Mutations are appended to the group's journal; its snapshot is only
+        # rewritten every `compact_every` records or when it leaves the cache.
+        return JsonStore(GROUPS_DIR, compact_every=int(os.environ.get("JOURNAL_COMPACT_EVERY", 1000)),
+                         legacy_snapshot=DATA_PATH, legacy_journal=JOURNAL_PATH)
+    raise ValueError(f"Unknown storage backend '{STORAGE_BACKEND}'.")
+
+
+# Initialize groups; they are loaded lazily on first access
+store = GroupCache(create_store(), capacity=GROUP_CACHE_CAPACITY, max_bytes=GROUP_CACHE_MAX_BYTES)
+atexit.register(store.flush_all)
+
+# Scan results by image content; repeat uploads of the same photo skip OCR
+ocr_cache = OCRCache(
+    capacity=int(os.environ.get("OCR_CACHE_SIZE", 256)),
+    directory=os.environ.get("OCR_CACHE_DIR"),  # Optional on-disk tier
+    max_disk_bytes=int(os.environ.get("OCR_CACHE_MAX_BYTES", 64 * 1024 * 1024)),
+)
+
+# Receipt OCR runs in a pool of worker processes instead of the request handlers
+ocr_jobs = OCRJobQueue(
+    max_workers=int(os.environ.get("OCR_WORKERS", 0)) or None,  # Default: one per CPU
+    max_queued=int(os.environ.get("OCR_MAX_QUEUED", 32)),
+    timeout=float(os.environ.get("OCR_JOB_TIMEOUT", 60)),
+    cache=ocr_cache,
+    max_jobs_per_worker=int(os.environ.get("OCR_WORKER_MAX_JOBS", 500)) or None,
+)
+atexit.register(ocr_jobs.shutdown)
+# Longest a status request may wait for a job to finish
+OCR_MAX_WAIT = 30
 
 
 
@@ -116,6 +141,7 @@ def handle_recurring_transaction(transaction, recurrence_interval):
         future_date = base_date + (interval * i)
         future_transaction = {
             "amount": transaction["amount"],
+            "currency": transaction.get("currency"),
             "explanation": transaction["explanation"],
             "timestamp": future_date.isoformat(),
             "from_user": transaction["from_user"],
@@ -129,11 +155,137 @@ def handle_recurring_transaction(transaction, recurrence_interval):
     return future_transactions
 
 
+def split_bill_shares(from_user, to_users, amounts, split_method, total_amount=None):
+    """
+    Compute the (to_user, amount) transactions of a split bill.
+
+    Ratio and percentage splits divide `total_amount` proportionally to
+    `amounts`; other methods use `amounts` as-is. The payer never owes themselves.
+    """
+    if split_method in ["ratio", "percentage"]:
+        if total_amount is None:
+            raise ValueError("Total amount is required for ratio or percentage splits.")
+        to_users, amounts = list(to_users), list(amounts)
+        if from_user in to_users:
+            payer_index = to_users.index(from_user)
+            amounts.pop(payer_index)
+            to_users.pop(payer_index)
+
+        # Split the total proportionally; the shares always add up to the total
+        return list(zip(to_users, allocate(total_amount, amounts)))
+
+    return [(to_user, amount) for to_user, amount in zip(to_users, amounts) if to_user != from_user]
+
+
+def cached_view(group, name, build):
+    """
+    Respond with a JSON view of `group` that is only rebuilt when the group changes.
+
+    The serialized body is cached per group version, and the version doubles
+    as the ETag, so polling with If-None-Match gets a 304 without anything
+    being built or serialized.
+    """
+    version = group.version
+    if request.if_none_match.contains(version):
+        response = Response(status=304)
+    else:
+        cached = group.payloads.get(name)
+        if cached is None or cached[0] != version:
+            cached = (version, app.json.dumps(build()))
+            group.payloads[name] = cached
+        response = Response(cached[1], mimetype="application/json")
+    response.set_etag(version)
+    # Let clients keep the body but revalidate it on every request
+    response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+# Upper bound for the `limit` parameter of paginated endpoints
+MAX_PAGE_LIMIT = 1000
+
+
+def encode_cursor(transaction):
+    """Encode the position of a transaction in the time index as an opaque cursor."""
+    key = ExpenseGraph.transaction_key(transaction)
+    return base64.urlsafe_b64encode(json.dumps(key).encode()).decode()
+
+
+def decode_cursor(cursor):
+    """Decode a cursor from `encode_cursor` back into a (timestamp, ID) key."""
+    try:
+        timestamp, transaction_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (ValueError, TypeError):
+        raise ValueError("Invalid cursor.")
+    if not isinstance(timestamp, str) or not isinstance(transaction_id, int):
+        raise ValueError("Invalid cursor.")
+    return timestamp, transaction_id
+
+
+def page_args():
+    """
+    Read the pagination parameters of a listing endpoint.
+
+    `cursor` is the `next_cursor` of the previous page, `limit` the page size
+    (everything when omitted) and `fields` a comma-separated list of the keys
+    to return.
+
+    Returns:
+        tuple: (after key or None, limit or None, list of fields or None)
+    """
+    cursor = request.args.get("cursor")
+    after = decode_cursor(cursor) if cursor else None
+    limit = request.args.get("limit", type=int)
+    if limit is not None:
+        if limit < 1:
+            raise ValueError("limit must be positive.")
+        limit = min(limit, MAX_PAGE_LIMIT)
+    fields = request.args.get("fields")
+    fields = [field for field in fields.split(",") if field] if fields else None
+    return after, limit, fields
+
+
+def project(item, fields):
+    """Keep only the requested `fields` of a response item."""
+    if fields is None:
+        return item
+    return {field: item[field] for field in fields if field in item}
+
+
+def next_cursor(page, limit):
+    """Cursor of the page after `page`, or None if `page` was the last one."""
+    if limit is None or len(page) < limit:
+        return None
+    return encode_cursor(page[-1])
+
+
+def bulk_row_edges(row):
+    """Turn one bulk import row, a transaction or a split bill, into transaction edges."""
+    if not isinstance(row, dict):
+        raise ValueError("Transaction must be an object.")
+    fields = {
+        "from": row.get("from_user"),
+        "currency": row.get("currency"),
+        "category": row.get("category"),
+        "timestamp": row.get("timestamp"),
+        "explanation": row.get("explanation"),
+    }
+    if "to_users" not in row:
+        return [{**fields, "to": row.get("to_user"), "amount": row.get("amount")}]
+
+    to_users, amounts = row.get("to_users"), row.get("amounts")
+    if not all([fields["from"], to_users, amounts, row.get("split_method")]):
+        raise ValueError("Missing transaction details")
+    if len(to_users) != len(amounts):
+        raise ValueError("Mismatch between to_users and amounts")
+    shares = split_bill_shares(fields["from"], to_users, amounts, row["split_method"], row.get("total_amount"))
+    return [{**fields, "to": to_user, "amount": amount} for to_user, amount in shares]
+
+
 
 @app.route("/groups", methods=["GET"])
 def fetch_groups():
     """Fetch all groups."""
-    return jsonify({"groups": list(groups.keys())}), 200
+    return jsonify({"groups": store.list_groups()}), 200
 
 @app.route("/groups", methods=["POST"])
 def add_group():
@@ -142,44 +294,76 @@ def add_group():
     if not group_name:
         return jsonify({"error": "Group name is required."}), 400
 
-    if group_name in groups:
+    if group_name in store:
         return jsonify({"error": "Group already exists."}), 400
 
-    groups[group_name] = Group(group_name)
-    save_groups(groups)
+    store.record(Group(group_name), "add_group")
     return jsonify({"message": f"Group '{group_name}' added successfully."}), 201
 
 @app.route("/groups/<group_name>/balance", methods=["GET"])
 def get_balance_graph(group_name):
     """Fetch the balance graph for a specific group."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
-    balance_graph = group.graph.balance_graph
-    return jsonify({
-        "nodes": list(set(balance_graph.graph.keys()) | 
-                      set(to_user for edges in balance_graph.graph.values() for to_user in edges.keys())),
-        "edges": [
-            {"from": from_user, "to": to_user, "amount": amount}
-            for from_user, edges in balance_graph.graph.items()
-            for to_user, amount in edges.items()
-        ]
-    }), 200
+    def build():
+        balance_graph = group.graph.balance_graph
+        return {
+            "currency": group.graph.currency,
+            "nodes": list(balance_graph.nodes()),
+            "edges": [
+                {"from": from_user, "to": to_user, "amount": amount}
+                for from_user, to_user, amount in balance_graph.edges()
+            ]
+        }
+
+    return cached_view(group, "balance", build)
+
+@app.route("/groups/<group_name>/balance/currencies", methods=["GET"])
+def get_currency_balances(group_name):
+    """Fetch every member's net balance in each currency the group has used."""
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    return cached_view(group, "currency_balances", lambda: {"balances": group.graph.balances_by_currency()})
+
+@app.route("/groups/<group_name>/balance/consolidated", methods=["GET"])
+def get_consolidated_balance(group_name):
+    """
+    Fetch every member's net balance across all currencies, converted to one.
+
+    The `currency` query parameter picks the settlement currency (default:
+    the group's default currency). Net balances are converted at current
+    rates when asked, so the result isn't cached with the group.
+    """
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    try:
+        currency = currency_code(request.args.get("currency", group.graph.currency))
+        balances = group.graph.consolidated_balances(currency, exchange_rates.convert_many)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except RatesUnavailable as e:
+        return jsonify({"error": str(e)}), 503
+    return jsonify({"currency": currency, "balances": balances}), 200
 
 @app.route("/groups/<group_name>/members", methods=["GET"])
 def fetch_group_members(group_name):
     """Fetch members of a specific group."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
-    return jsonify({"members": list(set(member.name for member in group.members))}), 200
+    return cached_view(group, "members", lambda: {"members": list(set(member.name for member in group.members))})
 
 @app.route("/groups/<group_name>/members", methods=["POST"])
 def add_member_to_group(group_name):
     """Add a member to a specific group."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
@@ -189,34 +373,45 @@ def add_member_to_group(group_name):
 
     user = User(member_name)
     group.add_member(user)
-    save_groups(groups)
+    store.record(group, "add_member", name=member_name)
     return jsonify({"message": f"Member '{member_name}' added to group '{group_name}'."}), 201
 
 @app.route("/groups/<group_name>/transactions", methods=["GET"])
 def fetch_group_transactions(group_name):
-    """Fetch all transactions for a specific group."""
-    group = groups.get(group_name)
+    """Fetch the transactions of a specific group, oldest first, optionally one page at a time."""
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
+    try:
+        after, limit, fields = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    page = group.graph.page_transactions(after, limit)
     transactions = [
-        {
-            "from_user": from_user,
+        project({
+            "id": transaction["id"],
+            "from_user": transaction["from"],
             "to_user": transaction["to"],
             "amount": transaction["amount"],
+            "currency": transaction["currency"],
             "category": transaction["category"],
             "timestamp": transaction["timestamp"],
-        }
-        for from_user, transactions in group.graph.graph.items()
-        for transaction in transactions
+        }, fields)
+        for transaction in page
     ]
 
-    return jsonify({"transactions": transactions}), 200
+    cursor = next_cursor(page, limit)
+    response = jsonify({"transactions": transactions, "next_cursor": cursor})
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return response, 200
 
 @app.route("/groups/<group_name>/transactions", methods=["POST"])
 def add_transaction(group_name):
     """Add a transaction to a group's expense graph and update the balance graph."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
@@ -227,6 +422,7 @@ def add_transaction(group_name):
     category = data.get("category")
     timestamp = data.get("timestamp")
     explanation = data.get("explanation")
+    currency = data.get("currency")  # Default: the group's default currency
     recurrence_interval = data.get("recurrence")
 
     if not all([from_user, to_user, amount, category]):
@@ -234,8 +430,12 @@ def add_transaction(group_name):
 
     try:
         # Add the original transaction
-        group.graph.add_transaction(from_user, to_user, amount, category, timestamp, explanation)
-        
+        transaction = group.graph.add_transaction(
+            from_user, to_user, amount, category, timestamp, explanation, currency=currency
+        )
+        store.record(group, "add_transaction", edge={"from": from_user, **transaction})
+        transaction_id = transaction["id"]
+
         # Handle recurring transactions if specified
         if recurrence_interval:
             future_transactions = handle_recurring_transaction(
@@ -246,23 +446,87 @@ def add_transaction(group_name):
                     "category": category,
                     "timestamp": timestamp,
                     "explanation": explanation,
+                    "currency": currency,
                 },
                 recurrence_interval
             )
             for future_transaction in future_transactions:
                 future_transaction.pop("is_recurring", None)
-                group.graph.add_transaction(**future_transaction)
+                transaction = group.graph.add_transaction(**future_transaction)
+                store.record(group, "add_transaction", edge={"from": from_user, **transaction})
 
-        save_groups(groups)
-        return jsonify({"message": "Transaction added successfully."}), 200
+        return jsonify({"message": "Transaction added successfully.", "id": transaction_id}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 405
 
+@app.route("/groups/<group_name>/transactions/bulk", methods=["POST"])
+def add_transactions_bulk(group_name):
+    """
+    Add many transactions and split bills in one request.
+
+    The body is {"transactions": [...]} where each row has the payload of
+    POST /transactions or of POST /group_transactions. Valid rows are applied
+    and persisted together; invalid ones are reported by index.
+    """
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    rows = (request.json or {}).get("transactions")
+    if not isinstance(rows, list):
+        return jsonify({"error": "A list of transactions is required."}), 400
+
+    edges, edge_rows, errors = [], [], []
+    for index, row in enumerate(rows):
+        try:
+            row_edges = bulk_row_edges(row)
+        except (ValueError, TypeError) as e:
+            errors.append({"row": index, "error": str(e)})
+            continue
+        edges.extend(row_edges)
+        edge_rows.extend([index] * len(row_edges))
+
+    added, edge_errors = group.graph.add_transactions(edges)
+    errors.extend({"row": edge_rows[edge_index], "error": error} for edge_index, error in edge_errors)
+    errors.sort(key=lambda error: error["row"])
+    if added:
+        store.record(group, "add_transactions", edges=added)
+
+    return jsonify({
+        "added": len(added),
+        "ids": [transaction["id"] for transaction in added],
+        "errors": errors
+    }), 200
+
+@app.route("/groups/<group_name>/export", methods=["GET"])
+def export_group(group_name):
+    """Stream a group's members and transactions as NDJSON."""
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    return Response(export_lines(group), mimetype="application/x-ndjson")
+
+@app.route("/groups/<group_name>/import", methods=["POST"])
+def import_group(group_name):
+    """Import NDJSON members and transactions, as written by the export, from the request body."""
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    # Read the body line by line instead of parsing it as a whole; the buffer
+    # makes readline a C-level scan instead of one stream read per chunk
+    imported, errors = import_lines(store, group, io.BufferedReader(request.stream))
+    return jsonify({
+        "imported": imported,
+        "errors": [{"line": line_number, "error": error} for line_number, error in errors]
+    }), 200
+
 @app.route("/groups/<group_name>/deltransactions", methods=["POST"])
 def del_transaction(group_name):
     """Add a member to a specific group."""
     print("lalala")
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
@@ -279,59 +543,114 @@ def del_transaction(group_name):
     print(f"{from_user, to_user, amount, category, timestamp, explanation}")
     print(group.graph.visualize_transactions())
 
-    group.graph.del_transaction(from_user, to_user, amount, category, timestamp, explanation)
-    save_groups(groups)
+    removed = group.graph.del_transaction(from_user, to_user, amount, category, timestamp, explanation)
+    store.record(group, "del_transaction", edge=removed)
     return jsonify({"message": f"Transaction deleted from group '{group_name}'."}), 201
 
+@app.route("/groups/<group_name>/transactions/<int:transaction_id>", methods=["DELETE"])
+def delete_transaction(group_name, transaction_id):
+    """Delete a transaction by its ID."""
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    try:
+        removed = group.graph.del_transaction_by_id(transaction_id)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+    store.record(group, "del_transaction", edge=removed)
+    return jsonify({"message": f"Transaction {transaction_id} deleted from group '{group_name}'.", "transaction": removed}), 200
+
 
 
 @app.route("/groups/<group_name>/simplify-debts", methods=["POST"])
 def simplify_debts(group_name):
     """Simplify debts for a specific group."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
+    if not group:
+        return jsonify({"error": f"Group '{group_name}' not found."}), 404
+
+    # Strategy can be given in the query string or the JSON body
+    data = request.get_json(silent=True) or {}
+    strategy = request.args.get("strategy") or data.get("strategy") or "greedy"
+    if strategy not in STRATEGIES:
+        return jsonify({"error": f"Unknown strategy '{strategy}'. Use one of: {', '.join(STRATEGIES)}."}), 400
+
+    report = group.graph.simplify_balances(strategy)
+    store.record(group, "simplify_debts", strategy=strategy)
+
+    return jsonify({"message": f"Debts for group '{group_name}' simplified successfully.", **report}), 200
+
+
+@app.route("/groups/<group_name>/settlements", methods=["GET"])
+def fetch_settlements(group_name):
+    """Fetch the group's current settlement plan: who pays whom to settle all balances."""
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
-    simplifier = DebtSimplification(group.graph.balance_graph)
-    simplifier.simplify_debts()
-    save_groups(groups)
+    def build():
+        plan = group.graph.settlement_plan()
+        return {
+            "transfers": [
+                {"from": debtor, "to": creditor, "amount": amount}
+                for debtor, creditor, amount in plan.transfers()
+            ],
+            "rebuilds": plan.rebuilds
+        }
 
-    return jsonify({"message": f"Debts for group '{group_name}' simplified successfully."}), 200
+    return cached_view(group, "settlements", build)
 
 
 @app.route("/groups/<group_name>/transactions/recent", methods=["GET"])
 def fetch_recent_transactions(group_name):
-    """Fetch the last three transactions for a specific group."""
-    group = groups.get(group_name)
+    """Fetch the most recent transactions (three unless `n` is given) for a specific group."""
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
 
-    recent_transactions = group.graph.fetch_recent_transactions()
+    n = request.args.get("n", 3, type=int)
+    if n < 0:
+        return jsonify({"error": "n must not be negative."}), 400
+
+    recent_transactions = group.graph.fetch_recent_transactions(n)
     return jsonify({"transactions": recent_transactions}), 200
 
 @app.route('/search_transactions', methods=['GET'])
 def search_transactions():
     group_name = request.args.get('group_name')  # Get the group name from the query parameters
     search_phrase = request.args.get('phrase', '')  # Get the search phrase from the query parameters
+    # Optional filters
+    min_amount = request.args.get('min_amount', type=float)
+    max_amount = request.args.get('max_amount', type=float)
+    start = request.args.get('start')  # Timestamps, inclusive
+    end = request.args.get('end')
 
-    # Assuming you have a way to access the group by name
-    group = groups.get(group_name)  # 'groups' should be a dictionary of loaded groups
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": "Group not found"}), 404
 
-    transactions = group.graph.get_all_transactions()  # Get all transactions from the group's graph
-    filtered_transactions = [
-        transaction for transaction in transactions
-        if search_phrase.lower() in transaction['category'].lower() or
-           search_phrase.lower() in transaction['explanation'].lower()
-    ]
+    try:
+        after, limit, fields = page_args()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    filtered_transactions = group.graph.search_transactions(
+        search_phrase, min_amount, max_amount, start, end, after=after, limit=limit
+    )
 
-    return jsonify(filtered_transactions), 200  
+    # The body stays a plain list, so the next page's cursor goes in a header
+    response = jsonify([project(transaction, fields) for transaction in filtered_transactions])
+    cursor = next_cursor(filtered_transactions, limit)
+    if cursor:
+        response.headers["X-Next-Cursor"] = cursor
+    return response, 200
 
 @app.route("/groups/<group_name>/group_transactions", methods=["POST"])
 def add_splitbill(group_name):
     """Add a transaction to a group's expense graph and update the balance graph."""
-    group = groups.get(group_name)
+    group = store.get_group(group_name)
     if not group:
         return jsonify({"error": f"Group '{group_name}' not found."}), 404
     data = request.json
@@ -343,6 +662,7 @@ def add_splitbill(group_name):
     category = data.get("category")
     timestamp = data.get("timestamp")
     explanation = data.get("explanation")
+    currency = data.get("currency")
     if not all([from_user, to_users, amounts, category, split_method]):
         print(amounts)
         print(from_user, to_users, amounts, category, split_method)
@@ -351,78 +671,257 @@ def add_splitbill(group_name):
         print(to_users, amounts)
         return jsonify({"error": "Mismatch between to_users and amounts"}), 403
     try:
-        if split_method in ["ratio", "percentage"]:
-            if total_amount is None:
-                return jsonify({"error": "Total amount is required for ratio or percentage splits."}), 402
-            if from_user in to_users:
-                payer_index = to_users.index(from_user)
-                amounts.pop(payer_index)
-                to_users.pop(payer_index)
-                
-            # Calculate total amounts 
-            calculated_total = sum(amounts) 
-            # Add transactions for each user
-            for to_user, amount in zip(to_users, amounts):
-                group.graph.add_transaction(from_user, to_user, total_amount * amount / calculated_total , category, timestamp, explanation)
-                
-        else:
-            for to_user, amount in zip(to_users, amounts):
-                if to_user != from_user:
-                    group.graph.add_transaction(from_user, to_user, amount, category, timestamp, explanation)
-        save_groups(groups)
+        if split_method in ["ratio", "percentage"] and total_amount is None:
+            return jsonify({"error": "Total amount is required for ratio or percentage splits."}), 402
+
+        # Add transactions for each user
+        for to_user, amount in split_bill_shares(from_user, to_users, amounts, split_method, total_amount):
+            transaction = group.graph.add_transaction(
+                from_user, to_user, amount, category, timestamp, explanation, currency=currency
+            )
+            store.record(group, "add_transaction", edge={"from": from_user, **transaction})
         return jsonify({"message": "Transaction added successfully."}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 401
     
     
-UPLOAD_FOLDER = 'uploads'
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
-@app.route('/scan-receipt', methods=['POST'])
-def scan_receipt():
+def receipt_response(receipt_details):
+    """Turn the scanner's receipt details into a (payload, status code) response."""
+    if not receipt_details or 'items' not in receipt_details or not receipt_details['items']:
+        return {'error': 'Could not extract the desired data from the photo'}, 422
+    quantities = [item['quantity'] for item in receipt_details['items']]
+    names = [item['name'] for item in receipt_details['items']]
+    foods = []
+    for i, food in enumerate(names):
+        for j in range(int(quantities[i])):
+            foods.append(f'{food} number {j+1}')
+
+    return {'foods': foods, 'receiptDetails': receipt_details}, 200
+
+
+def payment_response(result):
+    """Turn the scanner's (amount, name_found) result into a (payload, status code) response."""
+    amount, name_found = result
+    if amount is None:  # Check if amount extraction failed
+        return {'error': 'Could not extract the desired data from the photo'}, 422
+    return {'amount': amount, 'name_found': name_found}, 200
+
+
+OCR_RESPONSES = {"receipt": receipt_response, "payment": payment_response}
+
+
+def queue_full_response(error):
+    response = jsonify({'error': str(error)})
+    response.headers['Retry-After'] = '1'
+    return response, 429
+
+
+def scan_options(kind):
+    """The job options of a scan request. Returns (options, None) or (None, error response)."""
+    if kind == "payment":
+        return {'name': request.form.get('name')}, None
+    grammar = request.form.get('grammar', 'restaurant')
+    if grammar not in receipt_parser.grammar_names(kind):
+        return None, (jsonify({'error': f"Unknown receipt grammar '{grammar}'."}), 400)
+    return {'grammar': grammar}, None
+
+
+def submit_scan(kind):
+    """Validate the uploaded photo and queue an OCR job for it. Returns (job ID, None) or (None, error response)."""
     image = request.files.get('photo')
-    if image and not allowed_file(image.filename):
-        return jsonify({'error': 'File type not allowed'}), 500
+    if not image or not allowed_file(image.filename):
+        return None, (jsonify({'error': 'File type not allowed'}), 400)
+
+    options, error = scan_options(kind)
+    if error:
+        return None, error
     try:
-        # Save the image for debugging purposes
-        file_path = os.path.join(UPLOAD_FOLDER, image.filename)
-        image.save(file_path)
-        # Perform OCR using pytesseract
-        receipt_details = scanner.process_expense_receipt(file_path)
-        if not receipt_details or 'items' not in receipt_details or not receipt_details['items']:
-            return jsonify({'error': 'Could not extract the desired data from the photo'}), 422
-        quantities = [item['quantity'] for item in receipt_details['items']]
-        names = [item['name'] for item in receipt_details['items']]
-        foods = []
-        for i, food in enumerate(names):
-            for j in range(int(quantities[i])):
-                foods.append(f'{food} number {j+1}')
-            
-        return jsonify({'foods': foods, 'receiptDetails': receipt_details})
-    
-    except Exception as e:
-        print(f"Error processing receipt: {e}")
-        return jsonify({'error': 'Failed to process receipt'}), 501
+        # The worker decodes the upload's bytes in memory
+        return ocr_jobs.submit(kind, image.read(), **options), None
+    except QueueFull as e:
+        return None, queue_full_response(e)
+
+
+def timings_ms(status):
+    """Milliseconds a finished job spent per stage (load, preprocessing, ocr, total); empty for cached scans."""
+    return {stage: round(seconds * 1000, 1) for stage, seconds in status.get('timings', {}).items()}
+
+
+def ocr_job_response(status):
+    """Response for a finished job's status, shaped like the synchronous scan endpoints."""
+    if status['status'] == 'done':
+        return OCR_RESPONSES[status['kind']](status['result'])
+    if status['status'] == 'timeout':
+        return {'error': status['error']}, 504
+    if status.get('invalid_image'):
+        return {'error': status['error']}, 422
+    print(f"Error processing receipt: {status.get('error')}")
+    return {'error': 'Failed to process receipt'}, 500
+
+
+@app.route('/scan-receipt', methods=['POST'])
+def scan_receipt():
+    """Scan a receipt and wait for the result. The OCR itself runs in the worker pool."""
+    job_id, error = submit_scan("receipt")
+    if error:
+        return error
+    payload, status_code = ocr_job_response(ocr_jobs.wait_result(job_id))
+    return jsonify(payload), status_code
     
 @app.route('/scan-payment', methods=['POST'])
 def scan_payment():
-    image = request.files.get('photo')
-    name = request.form.get('name')  # Adjusted to match formData input
-    if not image or not allowed_file(image.filename):
+    """Scan a payment receipt and wait for the result. The OCR itself runs in the worker pool."""
+    job_id, error = submit_scan("payment")
+    if error:
+        return error
+    payload, status_code = ocr_job_response(ocr_jobs.wait_result(job_id))
+    return jsonify(payload), status_code
+
+
+@app.route('/scan-receipts', methods=['POST'])
+def scan_receipts():
+    """
+    Scan several receipts at once, in parallel on the OCR worker pool.
+
+    The response is NDJSON: one line per receipt as soon as it finishes, in
+    completion order, with the receipt's `index` among the uploaded `photos`
+    and the `response` and `status_code` of /scan-receipt. A final `summary`
+    line reports the batch's timing.
+    """
+    start = time.perf_counter()
+    images = request.files.getlist('photos')
+    if not images:
+        return jsonify({'error': 'No photos uploaded.'}), 400
+    if any(not allowed_file(image.filename) for image in images):
         return jsonify({'error': 'File type not allowed'}), 400
-    try:
-        # Save the image for debugging purposes
-        file_path = os.path.join(UPLOAD_FOLDER, secure_filename(image.filename))
-        image.save(file_path)
-        # Perform OCR using scanner logic
-        amount, name_found = scanner.process_payment_receipt(file_path, name)
-        if amount is None:  # Check if amount extraction failed
-            return jsonify({'error': 'Could not extract the desired data from the photo'}), 422
-        return jsonify({'amount': amount, 'name_found': name_found})
-    except Exception as e:
-        print(f"Error processing receipt: {e}")
-        return jsonify({'error': 'Failed to process receipt'}), 500
+    options, error = scan_options("receipt")
+    if error:
+        return error
+    # A batch that could never fit in the queue is too large, not "try again later"
+    if len(images) > ocr_jobs.max_queued:
+        return jsonify({
+            'error': f"Too many receipts in one batch (limit {ocr_jobs.max_queued}).",
+            'limit': ocr_jobs.max_queued,
+        }), 413
+
+    # Read the uploads now, as the response is streamed after the request ends
+    uploads = [image.read() for image in images]
+    filenames = [image.filename for image in images]
+    waiting = list(range(len(images)))  # Indexes of receipts not submitted yet
+
+    def submit_waiting(job_ids):
+        """Submit waiting receipts until the queue is full."""
+        while waiting:
+            try:
+                job_ids[ocr_jobs.submit("receipt", uploads[waiting[0]], **options)] = waiting[0]
+            except QueueFull:
+                return
+            waiting.pop(0)
+
+    # Feed the batch to the pool in chunks that fit in the queue; only a queue
+    # without room for a single receipt is worth retrying later
+    job_ids = {}
+    submit_waiting(job_ids)
+    if not job_ids:
+        return queue_full_response(QueueFull("The OCR queue is full."))
+
+    def generate():
+        ocr_seconds = 0.0
+        cached = 0
+        chunk = job_ids
+        while chunk:
+            next_chunk = {}
+            for status in ocr_jobs.as_completed(chunk):
+                payload, status_code = ocr_job_response(status)
+                ocr_seconds += status.get('ocr_seconds', 0.0)
+                cached += bool(status.get('cached'))
+                index = chunk[status['id']]
+                yield json.dumps({
+                    'index': index,
+                    'filename': filenames[index],
+                    'status': status['status'],
+                    'status_code': status_code,
+                    'response': payload,
+                    'timings_ms': timings_ms(status),
+                }) + "\n"
+                # Each finished receipt frees a slot for the next one
+                submit_waiting(next_chunk)
+            chunk = next_chunk
+
+            # Other requests took the freed slots; wait for room up to the job timeout
+            deadline = time.time() + ocr_jobs.timeout
+            while not chunk and waiting and time.time() < deadline:
+                time.sleep(0.1)
+                submit_waiting(chunk)
+
+        for index in waiting:
+            yield json.dumps({
+                'index': index,
+                'filename': filenames[index],
+                'status': 'rejected',
+                'status_code': 429,
+                'response': {'error': 'The OCR queue stayed full.'},
+                'timings_ms': {},
+            }) + "\n"
+        wall_seconds = time.perf_counter() - start
+        yield json.dumps({'summary': {
+            'receipts': len(images),
+            'cached': cached,
+            'wall_ms': wall_seconds * 1000,
+            'ocr_ms': ocr_seconds * 1000,  # Sum over receipts; compare with wall_ms for the speedup
+        }}) + "\n"
+
+    return Response(generate(), mimetype="application/x-ndjson")
+
+
+@app.route('/scan-receipt/jobs', methods=['POST'])
+@app.route('/scan-payment/jobs', methods=['POST'])
+def submit_scan_job():
+    """Queue a receipt or payment scan and return its job ID right away."""
+    kind = "payment" if request.path.startswith('/scan-payment') else "receipt"
+    job_id, error = submit_scan(kind)
+    if error:
+        return error
+    return jsonify({'job_id': job_id, 'status_url': f'/ocr-jobs/{job_id}'}), 202
+
+
+@app.route('/ocr-jobs/<job_id>', methods=['GET'])
+def fetch_ocr_job(job_id):
+    """
+    Fetch the status of a scan job.
+
+    With `wait` (seconds, at most 30) the request is held until the job
+    finishes. Finished jobs include the same `response` and `status_code`
+    the synchronous endpoint would have returned.
+    """
+    wait_seconds = min(request.args.get('wait', 0, type=float), OCR_MAX_WAIT)
+    status = ocr_jobs.get(job_id, wait_seconds=wait_seconds)
+    if status is None:
+        return jsonify({'error': f"Job '{job_id}' not found."}), 404
+
+    if status['status'] in ('queued', 'running'):
+        return jsonify({'id': job_id, 'status': status['status']}), 200
+    payload, status_code = ocr_job_response(status)
+    return jsonify({
+        'id': job_id,
+        'status': status['status'],
+        'response': payload,
+        'status_code': status_code,
+        'timings_ms': timings_ms(status),
+    }), 200
         
 
+@app.route("/metrics", methods=["GET"])
+def fetch_metrics():
+    """Fetch cache statistics."""
+    return jsonify({
+        "group_cache": store.stats(),
+        "ocr_jobs": ocr_jobs.stats(),
+        "ocr_cache": ocr_cache.stats(),
+        "currency_rates": exchange_rates.stats(),
+    }), 200
+
+
 @app.route("/", methods=["GET"])
 def home():
     return jsonify({"message": "Welcome to the Splitwise Clone API"}), 200
@@ -1,17 +1,25 @@
 from collections import defaultdict
 import json
+import zlib
+from core.money import Money, json_default
+from core import vectorized
+
+def edge_checksum(from_user, to_user, amount):
+    return zlib.crc32(f"{from_user}\x1f{to_user}\x1f{Money.of(amount).cents}".encode())
+
 
 class BalanceGraph:
     def __init__(self):
         # Graph to store simplified financial obligations
         self.graph = defaultdict(dict)  # Directed graph of debts
-        self.balance = defaultdict(float)  # Net balance for each user
+        self.balance = defaultdict(Money)  # Net balance for each user
 
     def add_edge(self, from_user, to_user, amount):
         """Add or update a financial obligation between users."""
         if from_user == to_user:
             raise ValueError("A user cannot owe themselves.")
-        
+
+        amount = Money.of(amount)
         if amount <= 0:
             raise ValueError("Amount must be positive.")
 
@@ -24,11 +32,74 @@ class BalanceGraph:
         # Update the balance sheet
         self.update_balance(from_user, to_user, amount)
 
+    def add_edges(self, from_users, to_users, amounts, names=None):
+        """
+        Add many obligations at once from columnar arrays.
+
+        Amounts are aggregated per (from_user, to_user) pair with NumPy before
+        touching the graph, so the Python-level work is per distinct pair rather
+        than per row.
+
+        Args:
+            from_users: User names, or indexes into `names` if it is given.
+            to_users: User names, or indexes into `names` if it is given.
+            amounts: Amounts as numbers or Money.
+            names (list): Optional names for integer user columns.
+        """
+        if not vectorized.HAS_NUMPY:
+            if names is not None:
+                from_users = [names[i] for i in from_users]
+                to_users = [names[i] for i in to_users]
+            for from_user, to_user, amount in zip(from_users, to_users, amounts):
+                self.add_edge(from_user, to_user, amount)
+            return
+
+        from_ids, to_ids, names = vectorized.encode_users(from_users, to_users, names)
+        cents = vectorized.to_cents(amounts)
+        vectorized.validate(from_ids, to_ids, cents)
+
+        pairs = vectorized.aggregate_pairs(from_ids, to_ids, cents, len(names))
+        for from_id, to_id, pair_cents in zip(*(column.tolist() for column in pairs)):
+            from_user, to_user, amount = names[from_id], names[to_id], Money(pair_cents)
+            edges = self.graph[from_user]
+            edges[to_user] = edges[to_user] + amount if to_user in edges else amount
+            self.update_balance(from_user, to_user, amount)
+
     def update_balance(self, from_user, to_user, amount):
         """Update the balance sheet for users."""
         self.balance[from_user] -= amount
         self.balance[to_user] += amount
 
+    def get_edge(self, from_user, to_user):
+        """Return the amount from_user owes to_user, or None if there is no edge."""
+        return self.graph.get(from_user, {}).get(to_user)
+
+    def edges(self):
+        """Iterate over all (from_user, to_user, amount) edges."""
+        for from_user, edges in self.graph.items():
+            for to_user, amount in edges.items():
+                yield from_user, to_user, amount
+
+    def edge_count(self):
+        return sum(len(edges) for edges in self.graph.values())
+
+    def nodes(self):
+        """Return the set of users that appear on any edge."""
+        return set(self.graph.keys()) | set(to_user for edges in self.graph.values() for to_user in edges.keys())
+
+    def net_balances(self):
+        """Compute each user's net balance from the edges."""
+        net_balance = defaultdict(Money)
+        for from_user, to_user, amount in self.edges():
+            net_balance[from_user] -= amount
+            net_balance[to_user] += amount
+        return net_balance
+
+    def clear(self):
+        """Remove all edges and balances."""
+        self.graph.clear()
+        self.balance.clear()
+
     def visualize_graph(self):
         """Visualize the simplified debt graph."""
         for from_user, edges in self.graph.items():
@@ -43,7 +114,7 @@ class BalanceGraph:
             "balance": dict(self.balance)
         }
         with open(filename, "w") as file:
-            json.dump(data, file, indent=4)
+            json.dump(data, file, indent=4, default=json_default)
 
     def balance_to_dict(self):
         """Convert balance graph to a dictionary format."""
@@ -53,11 +124,40 @@ class BalanceGraph:
             "balance": dict(self.balance)
         }
 
+    def restore(self, edges):
+        """
+        Rebuild the graph and balances from persisted (from_user, to_user, amount) edges.
+
+        The edges are trusted as-is (no validation), so this is a single pass.
+        Returns the checksum of the restored edges.
+        """
+        graph = defaultdict(dict)
+        balance = defaultdict(Money)
+        checksum = 0
+        for from_user, to_user, amount in edges:
+            amount = Money.of(amount)
+            graph[from_user][to_user] = amount
+            balance[from_user] -= amount
+            balance[to_user] += amount
+            checksum = (checksum + edge_checksum(from_user, to_user, amount)) & 0xFFFFFFFF
+        self.graph = graph
+        self.balance = balance
+        return checksum
+
+    def checksum(self):
+        """Order-independent checksum of all edges, stored alongside snapshots."""
+        checksum = 0
+        for from_user, edges in self.graph.items():
+            for to_user, amount in edges.items():
+                checksum = (checksum + edge_checksum(from_user, to_user, amount)) & 0xFFFFFFFF
+        return checksum
+
     # Deserialization: Load graph and balances from a JSON file
     def load_from_file(self, filename):
         with open(filename, "r") as file:
             data = json.load(file)
-            self.graph = defaultdict(dict, {user: edges for user, edges in data["graph"].items()})
-            self.balance = defaultdict(float, data["balance"])
+            self.graph = defaultdict(dict, {user: {neighbor: Money.of(amount) for neighbor, amount in edges.items()}
+                                            for user, edges in data["graph"].items()})
+            self.balance = defaultdict(Money, {user: Money.of(amount) for user, amount in data["balance"].items()})
 
 
@@ -0,0 +1,237 @@
+from array import array
+from bisect import bisect_left
+from collections import defaultdict
+import json
+from core.balance_calculation import edge_checksum
+from core.money import Money, json_default
+from core import vectorized
+
+
+class CompactBalanceGraph:
+    """
+    Array-backed drop-in replacement for BalanceGraph.
+
+    Member names are interned to dense integer IDs. Each member's row is a
+    pair of parallel array('q') columns, creditor IDs (kept sorted) and
+    amounts in cents, and net balances live in one array indexed by ID, so an
+    edge costs 16 bytes instead of a dict entry with Money and name keys.
+    Memory grows with the number of edges, not with the square of the member
+    count.
+
+    `graph` and `balance` are read-only dict views built on demand for code
+    that still expects BalanceGraph's attributes.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        """Remove all edges, balances and interned names."""
+        self._ids = {}                 # name -> ID
+        self._names = []               # ID -> name
+        self._balance = array("q")     # ID -> net balance in cents
+        self._creditors = []           # from ID -> array of to IDs, sorted
+        self._amounts = []             # from ID -> array of cents, parallel to _creditors
+        self._edge_count = 0
+
+    def _intern(self, name):
+        user_id = self._ids.get(name)
+        if user_id is None:
+            user_id = len(self._names)
+            self._ids[name] = user_id
+            self._names.append(name)
+            self._balance.append(0)
+            self._creditors.append(array("q"))
+            self._amounts.append(array("q"))
+        return user_id
+
+    def add_edge(self, from_user, to_user, amount):
+        """Add or update a financial obligation between users."""
+        if from_user == to_user:
+            raise ValueError("A user cannot owe themselves.")
+
+        amount = Money.of(amount)
+        if amount <= 0:
+            raise ValueError("Amount must be positive.")
+
+        self._add_cents(self._intern(from_user), self._intern(to_user), amount.cents)
+
+    def _add_cents(self, from_id, to_id, cents):
+        creditors = self._creditors[from_id]
+        index = bisect_left(creditors, to_id)
+        if index < len(creditors) and creditors[index] == to_id:
+            self._amounts[from_id][index] += cents
+        else:
+            creditors.insert(index, to_id)
+            self._amounts[from_id].insert(index, cents)
+            self._edge_count += 1
+
+        self._balance[from_id] -= cents
+        self._balance[to_id] += cents
+
+    def add_edges(self, from_users, to_users, amounts, names=None):
+        """
+        Add many obligations at once from columnar arrays.
+
+        With NumPy the amounts are aggregated per (from_user, to_user) pair
+        first and then merged into each touched row with one sorted merge, so
+        Python only loops over rows, not edges.
+
+        Args:
+            from_users: User names, or indexes into `names` if it is given.
+            to_users: User names, or indexes into `names` if it is given.
+            amounts: Amounts as numbers or Money.
+            names (list): Optional names for integer user columns.
+        """
+        if not vectorized.HAS_NUMPY:
+            if names is not None:
+                from_users = [names[i] for i in from_users]
+                to_users = [names[i] for i in to_users]
+            for from_user, to_user, amount in zip(from_users, to_users, amounts):
+                self.add_edge(from_user, to_user, amount)
+            return
+
+        np = vectorized.np
+        from_ids, to_ids, names = vectorized.encode_users(from_users, to_users, names)
+        cents = vectorized.to_cents(amounts)
+        vectorized.validate(from_ids, to_ids, cents)
+
+        pair_from, pair_to, pair_cents = vectorized.aggregate_pairs(from_ids, to_ids, cents, len(names))
+        # Translate the batch's IDs into this graph's interned IDs
+        own_ids = np.array([self._intern(name) for name in names], dtype=np.int64)
+        pair_from, pair_to = own_ids[pair_from], own_ids[pair_to]
+
+        order = np.lexsort((pair_to, pair_from))
+        pair_from, pair_to, pair_cents = pair_from[order], pair_to[order], pair_cents[order]
+        starts = np.flatnonzero(np.diff(pair_from, prepend=-1)).tolist()
+        for start, end in zip(starts, starts[1:] + [len(pair_from)]):
+            self._merge_row(int(pair_from[start]), pair_to[start:end], pair_cents[start:end])
+
+        balance = np.frombuffer(self._balance, dtype=np.int64)
+        balance += vectorized.net_balances(pair_from, pair_to, pair_cents, len(balance))
+
+    def _merge_row(self, from_id, to_ids, cents):
+        """Merge sorted, distinct (to ID, cents) pairs into one member's row."""
+        np = vectorized.np
+        creditors = np.frombuffer(self._creditors[from_id], dtype=np.int64)
+        amounts = np.frombuffer(self._amounts[from_id], dtype=np.int64)
+
+        positions = np.searchsorted(creditors, to_ids)
+        found = positions < len(creditors)
+        found[found] = creditors[positions[found]] == to_ids[found]
+        amounts[positions[found]] += cents[found]
+
+        new = ~found
+        if new.any():
+            merged_ids = np.concatenate((creditors, to_ids[new]))
+            merged_cents = np.concatenate((amounts, cents[new]))
+            order = np.argsort(merged_ids, kind="stable")
+            self._creditors[from_id] = array("q", merged_ids[order].tobytes())
+            self._amounts[from_id] = array("q", merged_cents[order].tobytes())
+            self._edge_count += int(new.sum())
+
+    def update_balance(self, from_user, to_user, amount):
+        """Update the balance sheet for users."""
+        cents = Money.of(amount).cents
+        self._balance[self._intern(from_user)] -= cents
+        self._balance[self._intern(to_user)] += cents
+
+    def get_edge(self, from_user, to_user):
+        """Return the amount from_user owes to_user, or None if there is no edge."""
+        from_id = self._ids.get(from_user)
+        to_id = self._ids.get(to_user)
+        if from_id is None or to_id is None:
+            return None
+        creditors = self._creditors[from_id]
+        index = bisect_left(creditors, to_id)
+        if index < len(creditors) and creditors[index] == to_id:
+            return Money(self._amounts[from_id][index])
+        return None
+
+    def _edge_ids(self):
+        """Iterate over (from ID, to ID, cents) for every edge, row by row."""
+        for from_id, (creditors, amounts) in enumerate(zip(self._creditors, self._amounts)):
+            for to_id, cents in zip(creditors, amounts):
+                yield from_id, to_id, cents
+
+    def edges(self):
+        """Iterate over all (from_user, to_user, amount) edges."""
+        names = self._names
+        for from_id, to_id, cents in self._edge_ids():
+            yield names[from_id], names[to_id], Money(cents)
+
+    def edge_count(self):
+        return self._edge_count
+
+    def nodes(self):
+        """Return the set of users that appear on any edge."""
+        used = set()
+        for from_id, creditors in enumerate(self._creditors):
+            if creditors:
+                used.add(from_id)
+                used.update(creditors)
+        return set(self._names[user_id] for user_id in used)
+
+    def net_balances(self):
+        """Return each user's non-zero net balance, read from the balance array."""
+        return defaultdict(Money, {
+            self._names[user_id]: Money(cents) for user_id, cents in enumerate(self._balance) if cents
+        })
+
+    @property
+    def graph(self):
+        graph = defaultdict(dict)
+        for from_user, to_user, amount in self.edges():
+            graph[from_user][to_user] = amount
+        return graph
+
+    @property
+    def balance(self):
+        return defaultdict(Money, {name: Money(self._balance[user_id]) for name, user_id in self._ids.items()})
+
+    def visualize_graph(self):
+        """Visualize the simplified debt graph."""
+        for from_user, to_user, amount in self.edges():
+            print(f"{from_user} owes {to_user}: {amount}")
+
+    def save_to_file(self, filename):
+        with open(filename, "w") as file:
+            json.dump(self.balance_to_dict(), file, indent=4, default=json_default)
+
+    def balance_to_dict(self):
+        """Convert balance graph to a dictionary format."""
+        return {
+            "graph": {from_user: dict(edges) for from_user, edges in self.graph.items()},
+            "balance": dict(self.balance)
+        }
+
+    def restore(self, edges):
+        """
+        Rebuild the arrays from persisted (from_user, to_user, amount) edges.
+
+        The edges are trusted as-is (no validation), so this is a single pass.
+        Returns the checksum of the restored edges.
+        """
+        self.clear()
+        checksum = 0
+        for from_user, to_user, amount in edges:
+            amount = Money.of(amount)
+            self._add_cents(self._intern(from_user), self._intern(to_user), amount.cents)
+            checksum = (checksum + edge_checksum(from_user, to_user, amount)) & 0xFFFFFFFF
+        return checksum
+
+    def checksum(self):
+        """Order-independent checksum of all edges, stored alongside snapshots."""
+        checksum = 0
+        for from_user, to_user, amount in self.edges():
+            checksum = (checksum + edge_checksum(from_user, to_user, amount)) & 0xFFFFFFFF
+        return checksum
+
+    def load_from_file(self, filename):
+        with open(filename, "r") as file:
+            data = json.load(file)
+        self.restore(
+            (from_user, to_user, amount)
+            for from_user, edges in data["graph"].items()
+            for to_user, amount in edges.items()
+        )
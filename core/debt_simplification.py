@@ -1,28 +1,35 @@
-from collections import defaultdict
+import heapq
+import time
+from core.money import Money
 
-class DebtSimplification:
-    def __init__(self, balance_graph):
-        self.graph = balance_graph
 
-    def simplify_debts(self):
-        """Simplify the graph by reducing the number of transactions."""
-        # Create a net balance for each user
-        net_balance = defaultdict(float)
+class SimplificationStrategy:
+    """Turns net balances into a list of settlement payments."""
+    name = None
 
-        # Calculate net balances based on the graph
-        for from_user, obligations in self.graph.graph.items():
-            for to_user, amount in obligations.items():
-                net_balance[from_user] -= amount
-                net_balance[to_user] += amount
+    def settle(self, net_balance):
+        """
+        Compute payments that clear the given net balances.
+
+        Args:
+            net_balance (dict): Net balance for each user (negative means the user owes money).
+
+        Returns:
+            list: (debtor, creditor, amount) tuples.
+        """
+        raise NotImplementedError
 
+
+class GreedyStrategy(SimplificationStrategy):
+    """Pairs the first debtor with the first creditor, in insertion order."""
+    name = "greedy"
+
+    def settle(self, net_balance):
         # Separate creditors and debtors
         creditors = {user: balance for user, balance in net_balance.items() if balance > 0}
         debtors = {user: -balance for user, balance in net_balance.items() if balance < 0}
+        payments = []
 
-        # Clear the existing graph
-        self.graph.graph.clear()
-
-        # Simplify debts using a greedy approach
         while debtors and creditors:
             # Get a debtor and a creditor
             debtor, debt_amount = next(iter(debtors.items()))
@@ -30,9 +37,7 @@ class DebtSimplification:
 
             # Settle the smallest amount between debtor and creditor
             settle_amount = min(debt_amount, credit_amount)
-
-            # Update the graph with the simplified debt
-            self.graph.add_edge(debtor, creditor, settle_amount)
+            payments.append((debtor, creditor, settle_amount))
 
             # Adjust the amounts
             debt_amount -= settle_amount
@@ -49,12 +54,147 @@ class DebtSimplification:
             else:
                 creditors[creditor] = credit_amount
 
+        return payments
+
+
+class HeapGreedyStrategy(SimplificationStrategy):
+    """Repeatedly settles the largest debtor against the largest creditor, O(n log n)."""
+    name = "heap"
+
+    def settle(self, net_balance):
+        # Max-heaps via negated amounts; the index keeps ties in insertion order
+        debtors = [(balance, index, user) for index, (user, balance) in enumerate(net_balance.items()) if balance < 0]
+        creditors = [(-balance, index, user) for index, (user, balance) in enumerate(net_balance.items()) if balance > 0]
+        heapq.heapify(debtors)
+        heapq.heapify(creditors)
+        payments = []
+
+        while debtors and creditors:
+            debt_amount, debtor_index, debtor = heapq.heappop(debtors)
+            credit_amount, creditor_index, creditor = heapq.heappop(creditors)
+            debt_amount, credit_amount = -debt_amount, -credit_amount
+
+            settle_amount = min(debt_amount, credit_amount)
+            payments.append((debtor, creditor, settle_amount))
+
+            # Push back whoever still has something left
+            if debt_amount > settle_amount:
+                heapq.heappush(debtors, (settle_amount - debt_amount, debtor_index, debtor))
+            if credit_amount > settle_amount:
+                heapq.heappush(creditors, (settle_amount - credit_amount, creditor_index, creditor))
+
+        return payments
+
+
+class ExactStrategy(SimplificationStrategy):
+    """
+    Minimizes the number of payments.
+
+    A set of users whose balances sum to zero can always be settled with one
+    payment fewer than its size, so the minimum number of payments is the
+    number of users minus the maximum number of disjoint zero-sum subsets.
+    That maximum is found with a dynamic program over all subsets, which is
+    exponential, so groups with more than `max_members` users that have a
+    non-zero balance fall back to the heap strategy.
+    """
+    name = "exact"
+
+    def __init__(self, max_members=16):
+        self.max_members = max_members
+        self.fallback = HeapGreedyStrategy()
+
+    def settle(self, net_balance):
+        users = [user for user, balance in net_balance.items() if balance != 0]
+        if len(users) > self.max_members:
+            return self.fallback.settle(net_balance)
+
+        cents = [Money.of(net_balance[user]).cents for user in users]
+        n = len(users)
+        full = (1 << n) - 1
+
+        subset_sum = [0] * (full + 1)
+        best = [0] * (full + 1)
+        for mask in range(1, full + 1):
+            low_bit = mask & -mask
+            subset_sum[mask] = subset_sum[mask ^ low_bit] + cents[low_bit.bit_length() - 1]
+
+            most = 0
+            bits = mask
+            while bits:
+                bit = bits & -bits
+                if best[mask ^ bit] > most:
+                    most = best[mask ^ bit]
+                bits ^= bit
+            best[mask] = most + (1 if subset_sum[mask] == 0 else 0)
+
+        # Walk back from the full set; every zero-sum mask on the path closes a group
+        groups = []
+        mask = full
+        boundary = full
+        while mask:
+            target = best[mask] - (1 if subset_sum[mask] == 0 else 0)
+            bits = mask
+            while bits:
+                bit = bits & -bits
+                if best[mask ^ bit] == target:
+                    break
+                bits ^= bit
+            mask ^= bit
+            if subset_sum[mask] == 0:
+                groups.append(boundary ^ mask)
+                boundary = mask
+
+        payments = []
+        for group in groups:
+            members = {users[i]: net_balance[users[i]] for i in range(n) if group >> i & 1}
+            payments.extend(self.fallback.settle(members))
+        return payments
+
+
+STRATEGIES = {
+    GreedyStrategy.name: GreedyStrategy,
+    HeapGreedyStrategy.name: HeapGreedyStrategy,
+    ExactStrategy.name: ExactStrategy,
+}
+
+
+class DebtSimplification:
+    def __init__(self, balance_graph, strategy="greedy"):
+        if strategy not in STRATEGIES:
+            raise ValueError(f"Unknown simplification strategy '{strategy}'.")
+        self.graph = balance_graph
+        self.strategy = STRATEGIES[strategy]()
+
+    def simplify_debts(self):
+        """
+        Simplify the graph by reducing the number of transactions.
+
+        Returns:
+            dict: The strategy used, the number of transfers it produced and its runtime.
+        """
+        # Calculate net balances based on the graph
+        net_balance = self.graph.net_balances()
+
+        start = time.perf_counter()
+        payments = self.strategy.settle(net_balance)
+        runtime = time.perf_counter() - start
+
+        # Clear the existing graph
+        self.graph.clear()
+
+        # Update the graph with the simplified debts
+        for debtor, creditor, amount in payments:
+            self.graph.add_edge(debtor, creditor, amount)
+
         # Recalculate balances in the BalanceGraph
         self.recalculate_balances()
 
+        return {
+            "strategy": self.strategy.name,
+            "transfers": len(payments),
+            "runtime_ms": runtime * 1000
+        }
+
     def recalculate_balances(self):
         """Recalculate all balances based on the simplified graph."""
-        self.graph.balance.clear()  # Clear the existing balance sheet
-        for from_user, obligations in self.graph.graph.items():
-            for to_user, amount in obligations.items():
-                self.graph.update_balance(from_user, to_user, amount)
+        self.graph.restore(list(self.graph.edges()))
@@ -1,70 +1,485 @@
+from bisect import bisect_left, bisect_right, insort
 from collections import defaultdict
 from datetime import datetime
+import gc
+from itertools import islice
+from operator import itemgetter
 from core.balance_calculation import BalanceGraph
 from core.debt_simplification import DebtSimplification
+from core.money import Money, currency_code
+from core.search_index import TransactionSearchIndex
+from core.settlement import SettlementPlan
 
 class ExpenseGraph:
-    def __init__(self):
+    # Balance graph implementation used by new expense graphs
+    balance_graph_cls = BalanceGraph
+    # Currency of transactions that don't name one, and of `balance_graph`
+    currency = "USD"
+
+    def __init__(self, balance_graph_cls=None):
+        if balance_graph_cls is not None:
+            self.balance_graph_cls = balance_graph_cls
         # Graph to store detailed transaction history
-        self.graph = defaultdict(list)  # Stores detailed transactions
-        self.balance_graph = BalanceGraph()    # Underlying balance graph
+        self.graph = defaultdict(dict)  # Payer -> {transaction ID: transaction}
+        self.balance_graph = self.balance_graph_cls()    # Underlying balance graph
+        # Other currencies are balanced separately, in graphs rebuilt from the
+        # history on load; simplification and settlement plans cover `currency` only
+        self.currency_balance_graphs = {}  # Currency -> balance graph
+        # Secondary indexes of (timestamp, ID, from_user, transaction) entries,
+        # sorted by time; IDs increase with insertion, so they break ties
+        self.by_id = {}
+        self.by_time = []
+        self.by_user = defaultdict(list)  # Every transaction a user pays or receives
+        self.search_index = TransactionSearchIndex()  # Category/explanation tokens
+        # IDs of future-dated transactions that were never applied to their balance graph
+        self.unapplied = set()
+        self.next_id = 1
+        self.revision = 0  # Bumped by every mutation
+        self.settlements = None  # SettlementPlan, built on first use and then kept current
+
+    def _index_entry(self, from_user, transaction):
+        entry = (transaction["timestamp"] or "", transaction["id"], from_user, transaction)
+        self.by_id[transaction["id"]] = entry
+        return entry
+
+    def _assign_id(self, transaction_id=None):
+        """Return `transaction_id` (e.g. from a replayed journal) or the next free ID."""
+        if transaction_id is None:
+            transaction_id = self.next_id
+        elif isinstance(transaction_id, bool) or not isinstance(transaction_id, int) or transaction_id < 1:
+            raise ValueError(f"Invalid transaction ID: {transaction_id!r}")
+        elif transaction_id in self.by_id:
+            raise ValueError(f"Transaction {transaction_id} already exists.")
+        if transaction_id >= self.next_id:
+            self.next_id = transaction_id + 1
+        return transaction_id
+
+    def _participants(self, entry):
+        from_user, to_user = entry[2], entry[3]["to"]
+        return (from_user,) if from_user == to_user else (from_user, to_user)
+
+    def _index(self, from_user, transaction):
+        entry = self._index_entry(from_user, transaction)
+        insort(self.by_time, entry)
+        for user in self._participants(entry):
+            insort(self.by_user[user], entry)
+        self.search_index.add(entry)
+
+    def _unindex(self, entry):
+        del self.by_id[entry[1]]
+        del self.by_time[bisect_left(self.by_time, entry[:2])]
+        for user in self._participants(entry):
+            entries = self.by_user[user]
+            del entries[bisect_left(entries, entry[:2])]
+            if not entries:
+                del self.by_user[user]
+        self.search_index.remove(entry)
 
-    def add_transaction(self, from_user, to_user, amount, category, timestamp=None, explanation=None):
-        """Add a transaction between users and update the balance graph."""
+    def _currency(self, currency):
+        return self.currency if currency is None else currency_code(currency)
+
+    def balance_graph_for(self, currency):
+        """The balance graph of transactions in `currency`."""
+        if currency == self.currency:
+            return self.balance_graph
+        balance_graph = self.currency_balance_graphs.get(currency)
+        if balance_graph is None:
+            balance_graph = self.currency_balance_graphs[currency] = self.balance_graph_cls()
+        return balance_graph
+
+    def add_transaction(self, from_user, to_user, amount, category, timestamp=None, explanation=None, transaction_id=None,
+                        currency=None):
+        """Add a transaction between users and update the balance graph of its currency."""
+        # Validate everything before the transaction gets an ID or is indexed
+        amount = Money.of(amount)
         if amount <= 0:
             raise ValueError("Amount must be positive.")
+        if from_user == to_user:
+            raise ValueError("A user cannot owe themselves.")
+        currency = self._currency(currency)
         
         if timestamp is None:
             timestamp = datetime.utcnow().isoformat()
+        elif not isinstance(timestamp, str):
+            raise ValueError(f"Invalid timestamp: {timestamp!r}")
         
         transaction = {
+            "id": self._assign_id(transaction_id),
             "to": to_user,
             "amount": amount,
+            "currency": currency,
             "category": category,
             "timestamp": timestamp,
             "explanation": explanation
         }
         
         # Add the transaction to the history
-        self.graph[from_user].append(transaction)
+        self.graph[from_user][transaction["id"]] = transaction
+        self._index(from_user, transaction)
+        self.revision += 1
 
         # Update the balance graph
         if transaction["timestamp"] <= datetime.utcnow().isoformat():
-            self.balance_graph.add_edge(from_user, to_user, amount)
-        
-        
-    def fetch_recent_transactions(self):
-        # Assuming selected_group is a list of users in the group
-        all_transactions = self.get_all_transactions()
+            self.balance_graph_for(currency).add_edge(from_user, to_user, amount)
+            if self.settlements is not None and currency == self.currency:
+                self.settlements.add(from_user, to_user, amount)
+        else:
+            self.unapplied.add(transaction["id"])
+
+        return transaction
+
+
+    def load_transactions(self, edges):
+        """
+        Append persisted transaction edges to the history without touching
+        `balance_graph`, which is persisted separately. The balance graphs of
+        other currencies are built from them.
+
+        An edge's optional "applied" flag tells whether it is part of the
+        persisted `balance_graph`; without it, edges dated after now are taken
+        to be missing from it.
+
+        The cyclic garbage collector is paused meanwhile: every transaction
+        adds several long-lived containers, which would otherwise trigger
+        repeated full collections during a large load.
+        """
+        gc_enabled = gc.isenabled()
+        gc.disable()
+        try:
+            self._load_transactions(edges)
+        finally:
+            if gc_enabled:
+                gc.enable()
+
+    def _load_transactions(self, edges):
+        now = datetime.utcnow().isoformat()
+        entries = []
+        currency_edges = defaultdict(lambda: ([], [], []))  # Currency -> (from_users, to_users, amounts)
+        for edge in edges:
+            transaction = {
+                "id": self._assign_id(edge.get("id")),
+                "to": edge["to"],
+                "amount": Money.of(edge["amount"]),
+                # Transactions from before currencies existed are in the default currency
+                "currency": edge.get("currency") or self.currency,
+                "category": edge["category"],
+                "timestamp": edge["timestamp"],
+                "explanation": edge["explanation"]
+            }
+            self.graph[edge["from"]][transaction["id"]] = transaction
+            entries.append(self._index_entry(edge["from"], transaction))
+            applied = (transaction["timestamp"] or "") <= now
+            if transaction["currency"] == self.currency:
+                if edge.get("applied") is not None:
+                    applied = edge["applied"]
+            elif applied:
+                columns = currency_edges[transaction["currency"]]
+                columns[0].append(edge["from"])
+                columns[1].append(edge["to"])
+                columns[2].append(transaction["amount"])
+            if not applied:
+                self.unapplied.add(transaction["id"])
+        self._index_many(entries)
+        for currency, columns in currency_edges.items():
+            self.balance_graph_for(currency).add_edges(*columns)
+        self.revision += 1
+
+    def add_transactions(self, rows):
+        """
+        Validate and add many transactions in one pass.
+
+        Each row is a dict with "from", "to", "amount" and "category", and
+        optionally "currency", "timestamp", "explanation" and "id". Invalid
+        rows are skipped and reported; the valid ones are indexed with one
+        sort and applied to the balance graph of each currency with a single
+        batch `add_edges`.
+
+        Returns:
+            tuple: (added transactions including "from", list of (row index, error message))
+        """
+        now = datetime.utcnow().isoformat()
+        added, errors, entries = [], [], []
+        currency_edges = defaultdict(lambda: ([], [], []))  # Currency -> (from_users, to_users, amounts)
+        for index, row in enumerate(rows):
+            try:
+                if not isinstance(row, dict):
+                    raise ValueError("Transaction must be an object.")
+                from_user, to_user = row.get("from"), row.get("to")
+                if not all([from_user, to_user, row.get("amount"), row.get("category")]):
+                    raise ValueError("Missing transaction details")
+                if not isinstance(row["category"], str):
+                    raise ValueError(f"Invalid category: {row['category']!r}")
+                if from_user == to_user:
+                    raise ValueError("A user cannot owe themselves.")
+                amount = Money.of(row["amount"])
+                if amount.cents <= 0:
+                    raise ValueError("Amount must be positive.")
+                timestamp = row.get("timestamp") or now
+                if not isinstance(timestamp, str):
+                    raise ValueError(f"Invalid timestamp: {timestamp!r}")
+                currency = self._currency(row.get("currency"))
+                transaction_id = self._assign_id(row.get("id"))
+            except ValueError as e:
+                errors.append((index, str(e)))
+                continue
+
+            transaction = {
+                "id": transaction_id,
+                "to": to_user,
+                "amount": amount,
+                "currency": currency,
+                "category": row["category"],
+                "timestamp": timestamp,
+                "explanation": row.get("explanation")
+            }
+            self.graph[from_user][transaction_id] = transaction
+            entries.append(self._index_entry(from_user, transaction))
+            added.append({**transaction, "from": from_user})
+            if timestamp <= now:
+                columns = currency_edges[currency]
+                columns[0].append(from_user)
+                columns[1].append(to_user)
+                columns[2].append(amount)
+            else:
+                self.unapplied.add(transaction_id)
+
+        self._index_many(entries)
+        for currency, columns in currency_edges.items():
+            self.balance_graph_for(currency).add_edges(*columns)
+        if self.currency in currency_edges and self.settlements is not None:
+            # One rebuild is cheaper than updating the plan row by row
+            self.settlements.reset(self.balance_graph.net_balances())
+        if added:
+            self.revision += 1
+        return added, errors
+
+    def _index_many(self, entries):
+        """Add index entries for many transactions at once."""
+        # Sort once instead of inserting one by one: by ID, then stably by
+        # timestamp, which is cheaper than comparing whole entries
+        entries = sorted(entries, key=itemgetter(1))
+        entries.sort(key=itemgetter(0))
+        if self.by_time:
+            # Timsort merges the two sorted runs in linear time
+            self.by_time.extend(entries)
+            self.by_time.sort()
+        else:
+            self.by_time = entries
+        # Appending in time order keeps new per-user lists sorted; only users
+        # that already had entries need a merge
+        existing = set(self.by_user)
+        touched = set()
+        for entry in entries:
+            for user in self._participants(entry):
+                self.by_user[user].append(entry)
+                touched.add(user)
+        for user in touched & existing:
+            self.by_user[user].sort()
+        self.search_index.add_many(entries)
+
+    def rebuild_balance_graph(self):
+        """Recompute the balance graphs of all currencies from the transaction history."""
+        currency_edges = defaultdict(lambda: ([], [], []))  # Currency -> (from_users, to_users, amounts)
+        now = datetime.utcnow().isoformat()
+        self.unapplied = set()
+        for from_user, transaction in self.iter_transactions():
+            if transaction["timestamp"] > now:
+                self.unapplied.add(transaction["id"])
+            elif transaction["to"] != from_user:
+                columns = currency_edges[transaction["currency"]]
+                columns[0].append(from_user)
+                columns[1].append(transaction["to"])
+                columns[2].append(transaction["amount"])
+
+        self.balance_graph = self.balance_graph_cls()
+        self.currency_balance_graphs = {}
+        for currency, columns in currency_edges.items():
+            self.balance_graph_for(currency).add_edges(*columns)
+        self.settlements = None
+        self.revision += 1
 
-        # Sort transactions by timestamp in descending order
-        all_transactions.sort(key=lambda x: x["timestamp"], reverse=True)
+    def apply_due_transactions(self):
+        """
+        Apply future-dated transactions whose time has come to the balance
+        graph of their currency.
 
-        # Return the last three transactions
-        return all_transactions[:3]
+        Returns:
+            list: The IDs of the transactions that were applied.
+        """
+        if not self.unapplied:
+            return []
+        now = datetime.utcnow().isoformat()
+        due = sorted(transaction_id for transaction_id in self.unapplied if self.by_id[transaction_id][0] <= now)
+        for transaction_id in due:
+            self.unapplied.discard(transaction_id)
+            entry = self.by_id[transaction_id]
+            from_user, transaction = entry[2], entry[3]
+            if transaction["to"] == from_user:
+                continue
+            self.balance_graph_for(transaction["currency"]).add_edge(from_user, transaction["to"], transaction["amount"])
+            if self.settlements is not None and transaction["currency"] == self.currency:
+                self.settlements.add(from_user, transaction["to"], transaction["amount"])
+        if due:
+            self.revision += 1
+        return due
+
+    def iter_transactions(self):
+        """Iterate over (from_user, transaction) for every transaction, grouped by payer."""
+        for from_user, transactions in self.graph.items():
+            for transaction in transactions.values():
+                yield from_user, transaction
+
+    def get_transaction(self, transaction_id):
+        """Return the transaction with the given ID (including "from"), or None."""
+        entry = self.by_id.get(transaction_id)
+        return None if entry is None else {**entry[3], "from": entry[2]}
+
+    @staticmethod
+    def transaction_key(transaction):
+        """The (timestamp, ID) position of a transaction in the time index, used as a page cursor."""
+        return (transaction["timestamp"] or "", transaction["id"])
+
+    def _after(self, entries, after):
+        """Index of the first entry of sorted `entries` that comes after the key `after`."""
+        if after is None:
+            return 0
+        timestamp, transaction_id = after
+        return bisect_left(entries, (timestamp, transaction_id + 1))
+
+    def page_transactions(self, after=None, limit=None):
+        """
+        Return up to `limit` transactions in time order, starting after the
+        `transaction_key` `after`. Costs O(log n + limit).
+        """
+        low = self._after(self.by_time, after)
+        high = len(self.by_time) if limit is None else low + limit
+        return [{**entry[3], "from": entry[2]} for entry in self.by_time[low:high]]
+
+    def settlement_plan(self):
+        """
+        Return the group's SettlementPlan.
+
+        It is built from the net balances on first use and updated by every
+        later change to the balance graph. Simplifying debts keeps every net
+        balance, so it leaves the plan as it is.
+        """
+        if self.settlements is None:
+            self.settlements = SettlementPlan(self.balance_graph.net_balances())
+        return self.settlements
+
+    def balances_by_currency(self):
+        """Net balance of every user, per currency: {currency: {user: Money}}."""
+        balances = {}
+        for currency, balance_graph in [(self.currency, self.balance_graph), *self.currency_balance_graphs.items()]:
+            net = {user: amount for user, amount in balance_graph.net_balances().items() if amount}
+            if net:
+                balances[currency] = net
+        return balances
+
+    def consolidated_balances(self, currency, convert_many):
+        """
+        Net balance of every user across all currencies, converted to `currency`.
+
+        Only the net balances are converted, so the cost is one conversion
+        per (user, currency) pair however many transactions there are, and a
+        change of rates needs no pass over the history.
+
+        Args:
+            currency: The currency to convert to.
+            convert_many: Function (amounts, source currencies, target currency)
+                returning the converted amounts, e.g. ExchangeRates.convert_many.
+
+        Returns:
+            dict: {user: Money}
+        """
+        users, amounts, sources = [], [], []
+        for source, balances in self.balances_by_currency().items():
+            for user, amount in balances.items():
+                users.append(user)
+                amounts.append(float(amount))
+                sources.append(source)
+
+        consolidated = defaultdict(float)
+        for user, amount in zip(users, convert_many(amounts, sources, currency) if amounts else []):
+            consolidated[user] += amount
+        balances = {user: Money.of(amount) for user, amount in consolidated.items()}
+        return {user: amount for user, amount in balances.items() if amount}
+
+    def fetch_recent_transactions(self, n=3):
+        """Return the `n` most recent transactions, newest first."""
+        return [{**entry[3], "from": entry[2]} for entry in islice(reversed(self.by_time), n)]
+
+    def get_transactions_between(self, start=None, end=None):
+        """Return transactions with start <= timestamp <= end, oldest first. Either bound may be None."""
+        low = 0 if start is None else bisect_left(self.by_time, (start,))
+        # (end + "\uffff",) sorts after every timestamp equal to or extending `end`,
+        # so a date-only bound covers the whole day
+        high = len(self.by_time) if end is None else bisect_right(self.by_time, (end + "\uffff",))
+        return [{**entry[3], "from": entry[2]} for entry in self.by_time[low:high]]
+
+    def search_transactions(self, phrase="", min_amount=None, max_amount=None, start=None, end=None,
+                            after=None, limit=None):
+        """
+        Search transactions by category/explanation words, oldest first.
+
+        Every word of `phrase` must be a prefix of a word in the category or
+        explanation. An empty phrase matches every transaction. Amount and
+        timestamp bounds are inclusive; either may be None. `after` and
+        `limit` page through the results like `page_transactions`.
+        """
+        entries = self.search_index.search(phrase)
+        if entries is None:
+            # No text filter: walk the time index, already limited to the date range
+            # and the page start, and stop as soon as the page is full
+            low = 0 if start is None else bisect_left(self.by_time, (start,))
+            low = max(low, self._after(self.by_time, after))
+            high = len(self.by_time) if end is None else bisect_right(self.by_time, (end + "\uffff",))
+            entries = (self.by_time[i] for i in range(low, high))
+            start = end = None
+        else:
+            entries = entries[self._after(entries, after):]
+
+        min_amount = None if min_amount is None else Money.of(min_amount)
+        max_amount = None if max_amount is None else Money.of(max_amount)
+        results = []
+        for timestamp, _, from_user, transaction in entries:
+            if start is not None and timestamp < start:
+                continue
+            if end is not None and timestamp > end + "\uffff":
+                continue
+            if min_amount is not None and transaction["amount"] < min_amount:
+                continue
+            if max_amount is not None and transaction["amount"] > max_amount:
+                continue
+            results.append({**transaction, "from": from_user})
+            if len(results) == limit:
+                break
+        return results
 
     def visualize_transactions(self):
         """Visualize the detailed transactions."""
         for user, transactions in self.graph.items():
             print(f"Transactions by {user}:")
-            for transaction in transactions:
+            for transaction in transactions.values():
                 print(f"  -> {transaction['to']} | {transaction['amount']} | {transaction['category']} | {transaction['timestamp']}")
 
-    def simplify_balances(self):
+    def simplify_balances(self, strategy="greedy"):
         """Simplify the underlying balance graph."""
-        simplifier = DebtSimplification(self.balance_graph)
-        simplifier.simplify_debts()
+        simplifier = DebtSimplification(self.balance_graph, strategy)
+        report = simplifier.simplify_debts()
+        self.revision += 1
+        return report
 
     def get_transactions(self, user):
-        """Get all transactions involving a specific user."""
-        if user not in self.graph:
+        """Get all transactions involving a specific user, as payer or payee, oldest first."""
+        if user not in self.by_user:
             raise ValueError(f"User {user} does not exist.")
-        return self.graph[user]
+        return [{**entry[3], "from": entry[2]} for entry in self.by_user[user]]
     
     def get_all_transactions(self):
         transactions = []
         for key, value in self.graph.items():
-            for expense in value:
+            for expense in value.values():
                 transaction = expense
                 transaction['from'] = key
                 transactions.append(transaction)
@@ -75,7 +490,7 @@ class ExpenseGraph:
         transaction_to_remove = None
             
         # Search for the transaction explicitly
-        for transaction in self.graph[from_user]:
+        for transaction in self.graph.get(from_user, {}).values():
             if (
                 transaction["to"] == to_user and
                 transaction["amount"] == amount and
@@ -88,9 +503,35 @@ class ExpenseGraph:
         
         if transaction_to_remove is None:
             raise ValueError("Transaction not found in the list.")
-        
+
+        return self.del_transaction_by_id(transaction_to_remove["id"])
+
+    def del_transaction_by_id(self, transaction_id):
+        """
+        Delete a transaction by its ID and reverse its effect on the balance
+        graph, if it had one: future-dated transactions were never applied.
+
+        Returns:
+            dict: The removed transaction, including "from".
+        """
+        entry = self.by_id.get(transaction_id)
+        if entry is None:
+            raise ValueError(f"Transaction {transaction_id} not found.")
+        from_user, transaction = entry[2], entry[3]
+
         # Remove the transaction
-        self.graph[from_user].remove(transaction_to_remove)
+        payer_transactions = self.graph[from_user]
+        del payer_transactions[transaction_id]
+        if not payer_transactions:
+            del self.graph[from_user]
+        self._unindex(entry)
 
         # Update the balance graph
-        self.balance_graph.add_edge(to_user, from_user, amount)
+        if transaction_id in self.unapplied:
+            self.unapplied.discard(transaction_id)
+        else:
+            self.balance_graph_for(transaction["currency"]).add_edge(transaction["to"], from_user, transaction["amount"])
+            if self.settlements is not None and transaction["currency"] == self.currency:
+                self.settlements.add(transaction["to"], from_user, transaction["amount"])
+        self.revision += 1
+        return {**transaction, "from": from_user}
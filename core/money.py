@@ -0,0 +1,135 @@
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from fractions import Fraction
+import math
+
+CENT = Decimal("0.01")
+
+
+class Money:
+    """
+    An exact amount of money stored as integer minor units (cents).
+
+    Arithmetic and comparisons accept other Money values or plain numbers,
+    which are rounded to the nearest cent first.
+    """
+    __slots__ = ("cents",)
+
+    def __init__(self, cents=0):
+        self.cents = int(cents)
+
+    @classmethod
+    def of(cls, amount):
+        """Convert a number, numeric string or Money into Money."""
+        if isinstance(amount, Money):
+            return amount
+        if isinstance(amount, int) and not isinstance(amount, bool):
+            return cls(amount * 100)
+        if isinstance(amount, float) and math.isfinite(amount):
+            # Fast path for amounts that already have at most two decimals
+            cents = round(amount * 100)
+            if abs(amount * 100 - cents) < 1e-6:
+                return cls(cents)
+        try:
+            # Go through str() so floats like 0.1 convert to what they print as
+            value = Decimal(str(amount)).quantize(CENT, rounding=ROUND_HALF_UP)
+        except (InvalidOperation, ValueError, TypeError):
+            raise ValueError(f"Invalid amount: {amount!r}")
+        if not value.is_finite():
+            raise ValueError(f"Invalid amount: {amount!r}")
+        return cls(int(value * 100))
+
+    def __add__(self, other):
+        return Money(self.cents + Money.of(other).cents)
+
+    __radd__ = __add__
+
+    def __sub__(self, other):
+        return Money(self.cents - Money.of(other).cents)
+
+    def __rsub__(self, other):
+        return Money(Money.of(other).cents - self.cents)
+
+    def __neg__(self):
+        return Money(-self.cents)
+
+    def __abs__(self):
+        return Money(abs(self.cents))
+
+    def __eq__(self, other):
+        try:
+            return self.cents == Money.of(other).cents
+        except ValueError:
+            return NotImplemented
+
+    def __lt__(self, other):
+        return self.cents < Money.of(other).cents
+
+    def __le__(self, other):
+        return self.cents <= Money.of(other).cents
+
+    def __gt__(self, other):
+        return self.cents > Money.of(other).cents
+
+    def __ge__(self, other):
+        return self.cents >= Money.of(other).cents
+
+    def __hash__(self):
+        return hash(self.cents)
+
+    def __bool__(self):
+        return self.cents != 0
+
+    def __float__(self):
+        return self.cents / 100
+
+    def __str__(self):
+        sign = "-" if self.cents < 0 else ""
+        return f"{sign}{abs(self.cents) // 100}.{abs(self.cents) % 100:02d}"
+
+    def __repr__(self):
+        return f"Money('{self}')"
+
+
+def allocate(total, weights):
+    """
+    Split `total` proportionally to `weights` using the largest remainder method.
+
+    The parts always add up exactly to `total`.
+
+    Args:
+        total: The amount to split.
+        weights (list): Non-negative numbers, e.g. ratios or percentages.
+
+    Returns:
+        list: One Money per weight.
+    """
+    total = Money.of(total)
+    weights = [Fraction(weight) for weight in weights]
+    weight_sum = sum(weights)
+    if weight_sum <= 0 or any(weight < 0 for weight in weights):
+        raise ValueError("Split weights must be non-negative and add up to more than zero.")
+
+    quotas = [total.cents * weight / weight_sum for weight in weights]
+    parts = [quota.numerator // quota.denominator for quota in quotas]
+
+    # Hand the leftover cents to the largest fractional remainders, first come first served on ties
+    leftover = total.cents - sum(parts)
+    by_remainder = sorted(range(len(quotas)), key=lambda i: quotas[i] - parts[i], reverse=True)
+    for i in by_remainder[:leftover]:
+        parts[i] += 1
+
+    return [Money(cents) for cents in parts]
+
+
+def currency_code(code):
+    """Validate a three-letter currency code such as "eur" and return it in upper case."""
+    if not isinstance(code, str) or len(code) != 3 or not (code.isascii() and code.isalpha()):
+        raise ValueError(f"Invalid currency: {code!r}")
+    return code.upper()
+
+
+def json_default(value):
+    """`default` hook for json.dump(s) that writes Money as a plain number."""
+    if isinstance(value, Money):
+        return float(value)
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
@@ -0,0 +1,92 @@
+from bisect import bisect_left, insort
+from collections import defaultdict
+import re
+
+TOKEN_REGEX = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens; None yields no tokens."""
+    if not text:
+        return []
+    return TOKEN_REGEX.findall(str(text).lower())
+
+
+class TransactionSearchIndex:
+    """
+    Inverted index over the category and explanation of a group's transactions.
+
+    Entries are the (timestamp, ID, from_user, transaction) tuples of
+    ExpenseGraph's secondary indexes, keyed by transaction ID. Query tokens
+    match every indexed token they are a prefix of, found by bisecting a
+    sorted token list.
+    """
+
+    def __init__(self):
+        self.entries = {}                 # ID -> entry
+        self.postings = defaultdict(set)  # token -> IDs
+        self.tokens = []                  # Sorted distinct tokens
+
+    def _entry_tokens(self, entry):
+        transaction = entry[3]
+        return set(tokenize(transaction["category"])) | set(tokenize(transaction["explanation"]))
+
+    def add(self, entry):
+        seq = entry[1]
+        self.entries[seq] = entry
+        for token in self._entry_tokens(entry):
+            if token not in self.postings:
+                insort(self.tokens, token)
+            self.postings[token].add(seq)
+
+    def add_many(self, entries):
+        """Index many entries, sorting the token list once instead of inserting new tokens one by one."""
+        postings = self.postings
+        for entry in entries:
+            seq = entry[1]
+            self.entries[seq] = entry
+            for token in self._entry_tokens(entry):
+                postings[token].add(seq)
+        self.tokens = sorted(postings)
+
+    def remove(self, entry):
+        seq = entry[1]
+        if self.entries.pop(seq, None) is None:
+            return
+        for token in self._entry_tokens(entry):
+            postings = self.postings.get(token)
+            if postings is None:
+                continue
+            postings.discard(seq)
+            if not postings:
+                del self.postings[token]
+                del self.tokens[bisect_left(self.tokens, token)]
+
+    def _prefix_matches(self, prefix):
+        """Union of the postings of every token starting with `prefix`."""
+        matches = set()
+        i = bisect_left(self.tokens, prefix)
+        while i < len(self.tokens) and self.tokens[i].startswith(prefix):
+            matches |= self.postings[self.tokens[i]]
+            i += 1
+        return matches
+
+    def search(self, phrase):
+        """
+        Return the entries matching every token of `phrase`, ordered by time.
+
+        Returns None for a phrase without tokens so callers can treat it as
+        "no text filter".
+        """
+        query_tokens = tokenize(phrase)
+        if not query_tokens:
+            return None
+
+        # Start from the rarest token so the intersection stays small
+        candidates = sorted((self._prefix_matches(token) for token in set(query_tokens)), key=len)
+        seqs = candidates[0]
+        for matches in candidates[1:]:
+            seqs = seqs & matches
+            if not seqs:
+                break
+        return sorted(self.entries[seq] for seq in seqs)
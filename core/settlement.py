@@ -0,0 +1,118 @@
+from collections import defaultdict
+from core.debt_simplification import HeapGreedyStrategy
+from core.money import Money
+
+
+class SettlementPlan:
+    """
+    A "who pays whom" plan that settles a group's net balances, kept current
+    one obligation at a time instead of being recomputed.
+
+    A new obligation first cancels against a transfer in the opposite
+    direction, then is rerouted through transfers its users already take part
+    in, and only becomes a new transfer when neither applies. Every step either
+    removes a transfer or uses up the obligation, so an update costs amortized
+    O(1).
+
+    Rerouting can leave more transfers than a fresh plan needs, which is at
+    most one fewer than the number of users with a non-zero balance. Once the
+    plan exceeds that by more than `max_drift` times the number of those users
+    it is rebuilt with `strategy`. A rebuild costs O(n log n) and an update
+    adds at most one transfer, so rebuilds amortize to O(log n) per update.
+    """
+
+    def __init__(self, net_balance, strategy=None, max_drift=0.25):
+        self.strategy = strategy or HeapGreedyStrategy()
+        self.max_drift = max_drift
+        self.rebuilds = 0
+        self.reset(net_balance)
+
+    def reset(self, net_balance):
+        """Rebuild the plan from scratch for the given net balances."""
+        self.net = {}  # user -> net balance in cents, non-zero only
+        for user, balance in net_balance.items():
+            self._adjust_net(user, Money.of(balance).cents)
+        self._rebuild()
+
+    def _rebuild(self):
+        self.pays = defaultdict(dict)      # debtor -> {creditor: cents}
+        self.receives = defaultdict(dict)  # creditor -> {debtor: cents}
+        self.count = 0
+        # Strategies only compare and subtract amounts, so plain cents work and are much faster
+        for debtor, creditor, cents in self.strategy.settle(self.net):
+            self._change(debtor, creditor, cents)
+
+    def _adjust_net(self, user, cents):
+        balance = self.net.get(user, 0) + cents
+        if balance:
+            self.net[user] = balance
+        else:
+            self.net.pop(user, None)
+
+    def _amount(self, debtor, creditor):
+        transfers = self.pays.get(debtor)
+        return transfers.get(creditor, 0) if transfers else 0
+
+    def _change(self, debtor, creditor, cents):
+        """Add `cents`, which may be negative, to the debtor -> creditor transfer."""
+        amount = self._amount(debtor, creditor) + cents
+        if amount:
+            if not self._amount(debtor, creditor):
+                self.count += 1
+            self.pays[debtor][creditor] = amount
+            self.receives[creditor][debtor] = amount
+            return
+
+        self.count -= 1
+        del self.pays[debtor][creditor]
+        del self.receives[creditor][debtor]
+        if not self.pays[debtor]:
+            del self.pays[debtor]
+        if not self.receives[creditor]:
+            del self.receives[creditor]
+
+    def add(self, from_user, to_user, amount):
+        """Update the plan for a new obligation: `from_user` owes `to_user` `amount` more."""
+        cents = Money.of(amount).cents
+        self._adjust_net(from_user, -cents)
+        self._adjust_net(to_user, cents)
+
+        # Cancel against a transfer the other way
+        reverse = self._amount(to_user, from_user)
+        if reverse:
+            step = min(reverse, cents)
+            self._change(to_user, from_user, -step)
+            cents -= step
+
+        # Whoever pays from_user pays to_user instead
+        while cents and from_user in self.receives:
+            payer, paid = next(iter(self.receives[from_user].items()))
+            step = min(paid, cents)
+            self._change(payer, from_user, -step)
+            self._change(payer, to_user, step)
+            cents -= step
+
+        # from_user pays whoever to_user pays instead
+        while cents and to_user in self.pays:
+            payee, paid = next(iter(self.pays[to_user].items()))
+            step = min(paid, cents)
+            self._change(to_user, payee, -step)
+            self._change(from_user, payee, step)
+            cents -= step
+
+        if cents:
+            self._change(from_user, to_user, cents)
+
+        if self.drift() > self.max_drift * len(self.net):
+            self._rebuild()
+            self.rebuilds += 1
+
+    def drift(self):
+        """Number of transfers beyond what a fresh plan could need."""
+        return self.count - max(len(self.net) - 1, 0)
+
+    def transfers(self):
+        """Iterate over all (debtor, creditor, amount) transfers of the plan."""
+        for debtor, creditors in self.pays.items():
+            for creditor, cents in creditors.items():
+                yield debtor, creditor, Money(cents)
@@ -0,0 +1,89 @@
+# NumPy helpers for applying many balance edges at once.
+#
+# All amounts are int64 cents so the aggregation is exact. NumPy is optional:
+# callers check HAS_NUMPY and fall back to their per-edge code paths.
+try:
+    import numpy as np
+    HAS_NUMPY = True
+except ImportError:
+    np = None
+    HAS_NUMPY = False
+
+from core.money import Money
+
+
+def encode_users(from_users, to_users, names=None):
+    """
+    Map the user columns to dense integer IDs.
+
+    If `names` is given, the columns already hold indexes into it and are used
+    as-is; otherwise they hold user names that get interned here.
+
+    Returns:
+        tuple: (from_ids, to_ids, names)
+    """
+    if names is not None:
+        return np.asarray(from_users, dtype=np.int64), np.asarray(to_users, dtype=np.int64), list(names)
+
+    ids = {}
+    from_ids = np.fromiter((ids.setdefault(user, len(ids)) for user in from_users), dtype=np.int64)
+    to_ids = np.fromiter((ids.setdefault(user, len(ids)) for user in to_users), dtype=np.int64)
+    return from_ids, to_ids, list(ids)
+
+
+def to_cents(amounts):
+    """
+    Convert a column of amounts (numbers or Money) to an int64 array of cents,
+    rounded the way Money.of rounds them.
+
+    Raises:
+        ValueError: If an amount is not a valid number.
+    """
+    if isinstance(amounts, np.ndarray) and amounts.dtype.kind in "iu":
+        return amounts.astype(np.int64) * 100
+    if isinstance(amounts, np.ndarray) and amounts.dtype.kind == "f":
+        # Like Money.of's fast path: amounts with at most two decimals round here,
+        # the rest (half cents, NaN, infinity) go through Money.of to round half up or fail
+        with np.errstate(invalid="ignore"):
+            scaled = amounts.astype(np.float64) * 100
+            cents = np.rint(scaled)
+            inexact = np.flatnonzero(~(np.abs(scaled - cents) < 1e-6))
+            cents = cents.astype(np.int64)
+        for index in inexact.tolist():
+            cents[index] = Money.of(float(amounts[index])).cents
+        return cents
+    return np.fromiter((Money.of(amount).cents for amount in amounts), dtype=np.int64)
+
+
+def validate(from_ids, to_ids, cents):
+    """Apply BalanceGraph.add_edge's checks to every row at once."""
+    if not (len(from_ids) == len(to_ids) == len(cents)):
+        raise ValueError("from_users, to_users and amounts must have the same length.")
+    self_edges = np.flatnonzero(from_ids == to_ids)
+    if self_edges.size:
+        raise ValueError(f"Row {self_edges[0]}: A user cannot owe themselves.")
+    non_positive = np.flatnonzero(cents <= 0)
+    if non_positive.size:
+        raise ValueError(f"Row {non_positive[0]}: Amount must be positive.")
+
+
+def aggregate_pairs(from_ids, to_ids, cents, size):
+    """
+    Sum the amounts of every (from, to) pair.
+
+    Returns:
+        tuple: (pair_from, pair_to, pair_cents) arrays with one entry per distinct pair.
+    """
+    keys = from_ids * size + to_ids
+    pair_keys, inverse = np.unique(keys, return_inverse=True)
+    pair_cents = np.zeros(len(pair_keys), dtype=np.int64)
+    np.add.at(pair_cents, inverse, cents)
+    return pair_keys // size, pair_keys % size, pair_cents
+
+
+def net_balances(from_ids, to_ids, cents, size):
+    """Net balance in cents per ID: what each user is owed minus what they owe."""
+    net = np.zeros(size, dtype=np.int64)
+    np.add.at(net, to_ids, cents)
+    np.subtract.at(net, from_ids, cents)
+    return net
@@ -1,3 +1,4 @@
+import uuid
 from .user import User
 from core.graph import ExpenseGraph
 
@@ -6,7 +7,17 @@ class Group:
         self.name = name
         self.members = [User('Me')] + (members or [])
         self.graph = ExpenseGraph()
+        # Unique to this in-memory copy, so versions of a reloaded group never repeat
+        self.epoch = uuid.uuid4().hex[:16]
+        self.revision = 0
+        self.payloads = {}  # Serialized views: name -> (version, body)
 
     def add_member(self, user):
         if user not in self.members:
             self.members.append(user)
+            self.revision += 1
+
+    @property
+    def version(self):
+        """Opaque token that changes whenever the members or the expense graph change."""
+        return f"{self.epoch}.{self.revision + self.graph.revision}"
@@ -0,0 +1,35 @@
+class GroupStore:
+    """
+    Interface for group persistence backends.
+
+    Endpoints fetch groups with `get_group`, mutate them in memory through the
+    Group/ExpenseGraph API and then call `record` with the same mutation so the
+    backend can persist it.
+
+    Supported operations (`op` with its keyword fields):
+        add_group
+        add_member       name
+        add_transaction  edge
+        add_transactions edges
+        del_transaction  edge
+        simplify_debts   strategy
+    """
+
+    def list_groups(self):
+        """Return the names of all stored groups."""
+        raise NotImplementedError
+
+    def get_group(self, name):
+        """Return the group with the given name, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    def record(self, group, op, **fields):
+        """Persist a mutation that has already been applied to `group`."""
+        raise NotImplementedError
+
+    def flush(self, group):
+        """Make sure everything recorded for `group` is durable in its compact form."""
+        pass
+
+    def __contains__(self, name):
+        return self.get_group(name) is not None
@@ -0,0 +1,123 @@
+import threading
+from collections import OrderedDict
+from storage.base import GroupStore
+
+# Rough per-object costs used to estimate the memory held by a hydrated group
+MEMBER_BYTES = 200
+TRANSACTION_BYTES = 600
+BALANCE_EDGE_BYTES = 200
+
+
+def estimate_group_size(group):
+    """Approximate the resident size of a hydrated group in bytes."""
+    transactions = len(group.graph.by_id)
+    edges = group.graph.balance_graph.edge_count()
+    return len(group.members) * MEMBER_BYTES + transactions * TRANSACTION_BYTES + edges * BALANCE_EDGE_BYTES
+
+
+class GroupCache(GroupStore):
+    """
+    Bounded LRU cache of hydrated groups in front of another GroupStore.
+
+    Groups are hydrated from the underlying store on first access. When the
+    cache holds more than `capacity` groups or more than `max_bytes` (estimated)
+    the least recently used groups are flushed if dirty and evicted.
+    """
+
+    def __init__(self, store, capacity=128, max_bytes=None):
+        self.store = store
+        self.capacity = capacity
+        self.max_bytes = max_bytes
+        self.groups = OrderedDict()
+        self.sizes = {}
+        self.dirty = set()
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def list_groups(self):
+        return self.store.list_groups()
+
+    def __contains__(self, name):
+        return name in self.groups or name in self.store
+
+    def get_group(self, name):
+        with self.lock:
+            group = self.groups.get(name)
+            if group is not None:
+                self.hits += 1
+                self.groups.move_to_end(name)
+            else:
+                self.misses += 1
+                group = self.store.get_group(name)
+                if group is None:
+                    return None
+                self._insert(group)
+
+            # Future-dated transactions take effect once their time has come,
+            # whether the group was just loaded or has been cached for a while
+            due = group.graph.apply_due_transactions()
+            if due:
+                self.record(group, "apply_due", ids=due)
+            return group
+
+    def record(self, group, op, **fields):
+        self.store.record(group, op, **fields)
+        with self.lock:
+            if group.name in self.groups:
+                self._resize(group)
+            else:
+                self._insert(group)
+            self.dirty.add(group.name)
+            self._evict()
+
+    def flush(self, group):
+        with self.lock:
+            self.store.flush(group)
+            self.dirty.discard(group.name)
+
+    def flush_all(self):
+        """Flush every dirty group, e.g. before shutting down."""
+        with self.lock:
+            for name in list(self.dirty):
+                self.flush(self.groups[name])
+
+    def stats(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self.groups),
+                "capacity": self.capacity,
+                "bytes": self.total_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / lookups if lookups else 0.0,
+                "evictions": self.evictions,
+            }
+
+    def _insert(self, group):
+        self.groups[group.name] = group
+        self.sizes[group.name] = 0
+        self._resize(group)
+        self._evict()
+
+    def _resize(self, group):
+        size = estimate_group_size(group)
+        self.total_bytes += size - self.sizes[group.name]
+        self.sizes[group.name] = size
+
+    def _evict(self):
+        # Always keep the most recently used group, even if it alone exceeds the cap
+        while len(self.groups) > 1 and (
+            len(self.groups) > self.capacity or
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        ):
+            name, group = self.groups.popitem(last=False)
+            if name in self.dirty:
+                self.store.flush(group)
+                self.dirty.discard(name)
+            self.total_bytes -= self.sizes.pop(name)
+            self.evictions += 1
@@ -0,0 +1,124 @@
+import json
+import os
+import threading
+from core.money import json_default
+from models.group import Group
+from models.user import User
+from storage.snapshot import read_snapshot, write_snapshot
+
+
+def apply_record(groups, record):
+    """Apply a single journal record to the in-memory groups."""
+    op = record["op"]
+    name = record["group"]
+
+    if op == "add_group":
+        groups[name] = Group(name)
+        return
+
+    group = groups[name]
+    if op == "add_member":
+        group.add_member(User(record["name"]))
+    elif op == "add_transaction":
+        edge = record["edge"]
+        group.graph.add_transaction(
+            edge["from"], edge["to"], edge["amount"], edge["category"], edge["timestamp"], edge["explanation"],
+            transaction_id=edge.get("id"), currency=edge.get("currency")
+        )
+    elif op == "add_transactions":
+        group.graph.add_transactions(record["edges"])
+    elif op == "del_transaction":
+        edge = record["edge"]
+        # Journals written before transactions had IDs identify them by their fields
+        if edge.get("id") is not None:
+            group.graph.del_transaction_by_id(edge["id"])
+        else:
+            group.graph.del_transaction(
+                edge["from"], edge["to"], edge["amount"], edge["category"], edge["timestamp"], edge["explanation"]
+            )
+    elif op == "simplify_debts":
+        group.graph.simplify_balances(record.get("strategy", "greedy"))
+    elif op == "apply_due":
+        group.graph.apply_due_transactions()
+    else:
+        raise ValueError(f"Unknown journal operation '{op}'.")
+
+
+class Journal:
+    """
+    Write-ahead journal for group mutations.
+
+    Every mutation is appended to the journal as one JSON line, so a write costs
+    O(1) bytes regardless of how much data is stored. Every `compact_every`
+    records the full state is written to the snapshot file and the journal is
+    truncated.
+    """
+
+    def __init__(self, snapshot_path, journal_path=None, compact_every=1000):
+        self.snapshot_path = snapshot_path
+        self.journal_path = journal_path or os.path.splitext(snapshot_path)[0] + ".journal"
+        self.compact_every = compact_every
+        self.seq = 0
+        self.pending = 0  # Records written since the last snapshot
+        self.lock = threading.Lock()
+
+    def load(self):
+        """Read the latest snapshot and replay the journal tail on top of it."""
+        groups, self.seq = read_snapshot(self.snapshot_path)
+        self.pending = 0
+
+        if os.path.exists(self.journal_path):
+            valid = 0  # Bytes up to the end of the last complete record
+            complete = True  # Whether that record ends with its newline
+            with open(self.journal_path, "rb") as file:
+                for raw in file:
+                    if raw.strip():
+                        try:
+                            record = json.loads(raw)
+                        except ValueError:
+                            break  # Torn write at the end of the journal
+                        # Records up to `seq` are already part of the snapshot
+                        if record["seq"] > self.seq:
+                            apply_record(groups, record)
+                            self.seq = record["seq"]
+                            self.pending += 1
+                    valid += len(raw)
+                    complete = raw.endswith(b"\n")
+
+            # Cut off the torn tail, or the next append would be glued onto it
+            # and lost together with it on the next replay
+            if valid < os.path.getsize(self.journal_path) or not complete:
+                with open(self.journal_path, "r+b") as file:
+                    file.truncate(valid)
+                    if not complete:
+                        file.seek(valid)
+                        file.write(b"\n")
+                    file.flush()
+                    os.fsync(file.fileno())
+        return groups
+
+    def append(self, groups, op, group, **fields):
+        """Append one mutation record, compacting into a snapshot when due."""
+        with self.lock:
+            self.seq += 1
+            record = {"seq": self.seq, "op": op, "group": group, **fields}
+            with open(self.journal_path, "a") as file:
+                file.write(json.dumps(record, default=json_default) + "\n")
+                file.flush()
+                os.fsync(file.fileno())
+            self.pending += 1
+
+            if self.pending >= self.compact_every:
+                self._compact(groups)
+
+    def compact(self, groups):
+        """Write a full snapshot and truncate the journal."""
+        with self.lock:
+            self._compact(groups)
+
+    def _compact(self, groups):
+        # The snapshot records the last seq it contains, so a crash between the
+        # two steps below only leaves already-applied records in the journal.
+        write_snapshot(self.snapshot_path, groups, self.seq)
+        open(self.journal_path, "w").close()
+        self.pending = 0
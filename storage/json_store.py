@@ -0,0 +1,71 @@
+import os
+import threading
+from urllib.parse import quote, unquote
+from storage.base import GroupStore
+from storage.journal import Journal
+from storage.snapshot import write_snapshot
+
+
+class JsonStore(GroupStore):
+    """
+    Stores each group as its own JSON snapshot plus journal inside `directory`.
+
+    Groups are only parsed when they are requested, and a mutation appends one
+    record to the journal of the group it touches.
+    """
+
+    def __init__(self, directory, compact_every=1000, legacy_snapshot=None, legacy_journal=None):
+        self.directory = directory
+        self.compact_every = compact_every
+        self.journals = {}
+        self.lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self.names = set(
+            unquote(filename[:-len(".json")])
+            for filename in os.listdir(directory) if filename.endswith(".json")
+        )
+
+        # Split the old single-file snapshot into one file per group
+        if not self.names and legacy_snapshot and os.path.exists(legacy_snapshot):
+            for name, group in Journal(legacy_snapshot, legacy_journal).load().items():
+                write_snapshot(self._path(name), {name: group})
+                self.names.add(name)
+
+    def _path(self, name):
+        return os.path.join(self.directory, quote(name, safe="") + ".json")
+
+    def _journal(self, name):
+        with self.lock:
+            if name not in self.journals:
+                self.journals[name] = Journal(self._path(name), compact_every=self.compact_every)
+            return self.journals[name]
+
+    def list_groups(self):
+        return sorted(self.names)
+
+    def __contains__(self, name):
+        return name in self.names
+
+    def get_group(self, name):
+        if name not in self.names:
+            return None
+        return self._journal(name).load().get(name)
+
+    def load_all(self):
+        """Load every group, e.g. to migrate them to another backend."""
+        return {name: self.get_group(name) for name in self.list_groups()}
+
+    def record(self, group, op, **fields):
+        journal = self._journal(group.name)
+        if op == "add_group":
+            # Write the empty snapshot first so the group is addressable on disk
+            journal.compact({group.name: group})
+            self.names.add(group.name)
+            return
+        journal.append({group.name: group}, op, group.name, **fields)
+
+    def flush(self, group):
+        journal = self._journal(group.name)
+        if journal.pending:
+            journal.compact({group.name: group})
@@ -0,0 +1,135 @@
+"""
+Streaming NDJSON export and import of a group's history.
+
+Each line is one JSON object: {"type": "member", "name": ...} for members and
+{"type": "transaction", "id": ..., "from": ..., "to": ..., ...} for
+transactions. Both directions work one line at a time, so memory use doesn't
+grow with the size of the history.
+
+Command line usage (uses the storage backend configured for the app):
+    python -m storage.ndjson export <group> [-o file]
+    python -m storage.ndjson import <group> [-i file]
+"""
+import argparse
+import json
+import sys
+from core.money import json_default
+from models.group import Group
+from models.user import User
+
+
+def export_lines(group):
+    """Yield the group's members and transactions as NDJSON lines."""
+    for name in dict.fromkeys(member.name for member in group.members):
+        yield json.dumps({"type": "member", "name": name}) + "\n"
+
+    # Look transactions up by ID instead of iterating the graph's dicts, so a
+    # concurrent mutation can't break a running export; IDs follow insertion order
+    graph = group.graph
+    for transaction_id in range(1, graph.next_id):
+        transaction = graph.get_transaction(transaction_id)
+        if transaction is not None:
+            yield json.dumps({"type": "transaction", **transaction}, default=json_default) + "\n"
+
+
+def import_lines(store, group, lines, batch_size=5000):
+    """
+    Import NDJSON lines into `group`.
+
+    Transactions are applied and recorded in batches of `batch_size` through
+    ExpenseGraph.add_transactions. Into a group that never had transactions
+    (a restore), transactions keep their IDs; otherwise they get new ones, so
+    history can be merged into a group that already has some.
+
+    Returns:
+        tuple: (number of imported transactions, list of (line number, error message))
+    """
+    imported, errors = 0, []
+    batch, batch_lines = [], []
+    member_names = set(member.name for member in group.members)
+    keep_ids = group.graph.next_id == 1
+
+    def apply_batch():
+        nonlocal imported
+        added, batch_errors = group.graph.add_transactions(batch)
+        if added:
+            store.record(group, "add_transactions", edges=added)
+        imported += len(added)
+        errors.extend((batch_lines[index], error) for index, error in batch_errors)
+        batch.clear()
+        batch_lines.clear()
+
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode("utf-8")
+            except UnicodeDecodeError as e:
+                errors.append((line_number, f"Invalid UTF-8: {e}"))
+                continue
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            record = json.loads(line)
+        except json.JSONDecodeError as e:
+            errors.append((line_number, f"Invalid JSON: {e}"))
+            continue
+
+        record_type = record.get("type") if isinstance(record, dict) else None
+        if record_type == "transaction":
+            if not keep_ids:
+                record.pop("id", None)
+            batch.append(record)
+            batch_lines.append(line_number)
+            if len(batch) >= batch_size:
+                apply_batch()
+        elif record_type == "member":
+            name = record.get("name")
+            if not name:
+                errors.append((line_number, "Member name is required."))
+            elif name not in member_names:
+                group.add_member(User(name))
+                store.record(group, "add_member", name=name)
+                member_names.add(name)
+        else:
+            errors.append((line_number, f"Unknown record type {record_type!r}."))
+
+    if batch:
+        apply_batch()
+    errors.sort()
+    return imported, errors
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Export or import a group's history as NDJSON.")
+    parser.add_argument("command", choices=["export", "import"])
+    parser.add_argument("group")
+    parser.add_argument("-o", "--output", help="File to export to (default: stdout)")
+    parser.add_argument("-i", "--input", help="File to import from (default: stdin)")
+    args = parser.parse_args(argv)
+
+    # Share the app's storage configuration; its exit hook flushes the import
+    from app import store
+
+    group = store.get_group(args.group)
+    if args.command == "export":
+        if group is None:
+            parser.error(f"Group '{args.group}' not found.")
+        output = open(args.output, "w") if args.output else sys.stdout
+        with output:
+            output.writelines(export_lines(group))
+        return
+
+    if group is None:
+        group = Group(args.group)
+        store.record(group, "add_group")
+    source = open(args.input, "r") if args.input else sys.stdin
+    with source:
+        imported, errors = import_lines(store, group, source)
+    for line_number, error in errors:
+        print(f"line {line_number}: {error}", file=sys.stderr)
+    print(f"Imported {imported} transactions into '{args.group}'.", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+import json
+import os
+from core.money import json_default
+from models.group import Group
+from models.user import User
+
+
+def group_to_dict(group):
+    """Serialize a group, its transactions and its balance graph."""
+    transaction_edges = [
+        {"id": transaction["id"], "from": from_user, "to": transaction["to"], "amount": transaction["amount"],
+         "currency": transaction["currency"], "category": transaction["category"], "timestamp": transaction["timestamp"], "explanation": transaction["explanation"]}
+        for from_user, transaction in group.graph.iter_transactions()
+    ]
+    return {
+        "nodes": list(set(member.name for member in group.members)),
+        "edges": transaction_edges,
+        # Kept so IDs of deleted transactions are never handed out again
+        "next_id": group.graph.next_id,
+        # Future-dated transactions that `balance_graph` doesn't include
+        "unapplied": sorted(group.graph.unapplied),
+        "balance_graph": {
+            "nodes": list(group.graph.balance_graph.nodes()),
+            "edges": [
+                {"from": from_user, "to": to_user, "amount": amount}
+                for from_user, to_user, amount in group.graph.balance_graph.edges()
+            ],
+            # Lets the loader trust the edges above instead of replaying `edges`
+            "checksum": group.graph.balance_graph.checksum(),
+            "transactions": len(transaction_edges)
+        }
+    }
+
+
+def group_from_dict(name, data):
+    """Rebuild a group from its serialized form."""
+    group = Group(name, members=[User(member) for member in data["nodes"]])
+    edges = data["edges"]
+    if "unapplied" in data:
+        unapplied = set(data["unapplied"])
+        edges = ({**edge, "applied": edge["id"] not in unapplied} for edge in edges)
+    group.graph.load_transactions(edges)
+    group.graph.next_id = max(group.graph.next_id, data.get("next_id", 1))
+
+    # Restore the balance graph directly from the snapshot when it is consistent,
+    # otherwise (corrupted or written before checksums existed) rebuild it from
+    # the transaction history.
+    balance_graph_data = data.get("balance_graph", {})
+    checksum = group.graph.balance_graph.restore(
+        (edge["from"], edge["to"], edge["amount"]) for edge in balance_graph_data.get("edges", [])
+    )
+    if (balance_graph_data.get("checksum") != checksum or
+            balance_graph_data.get("transactions") != len(data["edges"])):
+        group.graph.rebuild_balance_graph()
+    return group
+
+
+def read_snapshot(path):
+    """Read a snapshot file. Returns (groups, seq) where seq is the last journal record it contains."""
+    if not os.path.exists(path):
+        return {}, 0
+    with open(path, "r") as file:
+        group_data = json.load(file)
+    groups = {name: group_from_dict(name, data) for name, data in group_data["groups"].items()}
+    return groups, group_data.get("seq", 0)
+
+
+def write_snapshot(path, groups, seq=0):
+    """Atomically write all groups to a snapshot file."""
+    group_data = {
+        "seq": seq,
+        "groups": {name: group_to_dict(group) for name, group in groups.items()}
+    }
+
+    # Write to a temporary file first so a crash never leaves a truncated snapshot
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w") as file:
+        json.dump(group_data, file, indent=4, default=json_default)
+        file.flush()
+        os.fsync(file.fileno())
+    os.replace(tmp_path, path)
@@ -0,0 +1,223 @@
+import sqlite3
+import threading
+from core.money import Money
+from models.group import Group
+from models.user import User
+from storage.base import GroupStore
+
+# Amounts are stored as REAL; Money converts back exactly since they are whole cents
+sqlite3.register_adapter(Money, float)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS groups (
+    name TEXT PRIMARY KEY,
+    next_id INTEGER
+);
+CREATE TABLE IF NOT EXISTS members (
+    group_name TEXT NOT NULL REFERENCES groups(name),
+    name TEXT NOT NULL,
+    PRIMARY KEY (group_name, name)
+);
+CREATE TABLE IF NOT EXISTS transactions (
+    id INTEGER PRIMARY KEY,
+    group_name TEXT NOT NULL REFERENCES groups(name),
+    tx_id INTEGER,
+    from_user TEXT NOT NULL,
+    to_user TEXT NOT NULL,
+    amount REAL NOT NULL,
+    currency TEXT,
+    category TEXT,
+    timestamp TEXT,
+    explanation TEXT,
+    applied INTEGER
+);
+CREATE INDEX IF NOT EXISTS idx_transactions_group_from ON transactions (group_name, from_user);
+CREATE INDEX IF NOT EXISTS idx_transactions_group_timestamp ON transactions (group_name, timestamp);
+CREATE TABLE IF NOT EXISTS balance_edges (
+    group_name TEXT NOT NULL REFERENCES groups(name),
+    from_user TEXT NOT NULL,
+    to_user TEXT NOT NULL,
+    amount REAL NOT NULL,
+    PRIMARY KEY (group_name, from_user, to_user)
+);
+"""
+
+
+class SQLiteStore(GroupStore):
+    """
+    Stores groups in SQLite and hydrates a single group per request.
+
+    Nothing is loaded at startup: `get_group` reads only the rows of the
+    requested group, and `record` writes only the rows a mutation touched.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(SCHEMA)
+        self._migrate()
+        self.conn.commit()
+
+    def _migrate(self):
+        """Add the columns of databases created before they existed."""
+        group_columns = [row[1] for row in self.conn.execute("PRAGMA table_info(groups)")]
+        if "next_id" not in group_columns:
+            # NULL falls back to one past the highest stored ID
+            self.conn.execute("ALTER TABLE groups ADD COLUMN next_id INTEGER")
+        columns = [row[1] for row in self.conn.execute("PRAGMA table_info(transactions)")]
+        if "currency" not in columns:
+            # NULL stands for the default currency, which is what older transactions are in
+            self.conn.execute("ALTER TABLE transactions ADD COLUMN currency TEXT")
+        if "applied" not in columns:
+            # NULL: whether the balance edges include it is inferred from the timestamp
+            self.conn.execute("ALTER TABLE transactions ADD COLUMN applied INTEGER")
+        if "tx_id" not in columns:
+            self.conn.execute("ALTER TABLE transactions ADD COLUMN tx_id INTEGER")
+            # Row IDs are unique across groups, so they are valid per-group IDs too
+            self.conn.execute("UPDATE transactions SET tx_id = id")
+        self.conn.execute(
+            "CREATE UNIQUE INDEX IF NOT EXISTS idx_transactions_group_tx_id ON transactions (group_name, tx_id)"
+        )
+
+    def list_groups(self):
+        with self.lock:
+            rows = self.conn.execute("SELECT name FROM groups ORDER BY rowid").fetchall()
+        return [name for (name,) in rows]
+
+    def __contains__(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT 1 FROM groups WHERE name = ?", (name,)).fetchone()
+        return row is not None
+
+    def get_group(self, name):
+        with self.lock:
+            row = self.conn.execute("SELECT next_id FROM groups WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                return None
+            members = self.conn.execute(
+                "SELECT name FROM members WHERE group_name = ? ORDER BY rowid", (name,)
+            ).fetchall()
+            transactions = self.conn.execute(
+                "SELECT tx_id, from_user, to_user, amount, currency, category, timestamp, explanation, applied "
+                "FROM transactions WHERE group_name = ? ORDER BY id", (name,)
+            ).fetchall()
+            edges = self.conn.execute(
+                "SELECT from_user, to_user, amount FROM balance_edges WHERE group_name = ?", (name,)
+            ).fetchall()
+
+        group = Group(name, members=[User(member) for (member,) in members])
+        # The default currency's balance graph is stored separately, so load_transactions
+        # only builds those of other currencies
+        group.graph.load_transactions(
+            {"id": tx_id, "from": from_user, "to": to_user, "amount": amount, "currency": currency,
+             "category": category, "timestamp": timestamp, "explanation": explanation,
+             "applied": None if applied is None else bool(applied)}
+            for tx_id, from_user, to_user, amount, currency, category, timestamp, explanation, applied in transactions
+        )
+        # Kept so IDs of deleted transactions are never handed out again
+        group.graph.next_id = max(group.graph.next_id, row[0] or 1)
+        group.graph.balance_graph.restore(edges)
+        return group
+
+    def record(self, group, op, **fields):
+        with self.lock, self.conn:
+            if op == "add_group":
+                self.conn.execute("INSERT INTO groups (name) VALUES (?)", (group.name,))
+                self._insert_members(group.name, [member.name for member in group.members])
+            elif op == "add_member":
+                self._insert_members(group.name, [fields["name"]])
+            elif op == "add_transaction":
+                edge = fields["edge"]
+                self._insert_transactions(group, [edge])
+                self._save_next_id(group)
+                self._sync_balance_edge(group, edge["from"], edge["to"])
+            elif op == "add_transactions":
+                edges = fields["edges"]
+                self._insert_transactions(group, edges)
+                self._save_next_id(group)
+                for from_user, to_user in set((edge["from"], edge["to"]) for edge in edges):
+                    self._sync_balance_edge(group, from_user, to_user)
+            elif op == "del_transaction":
+                edge = fields["edge"]
+                if edge.get("id") is not None:
+                    self.conn.execute(
+                        "DELETE FROM transactions WHERE group_name = ? AND tx_id = ?", (group.name, edge["id"])
+                    )
+                else:
+                    self.conn.execute(
+                        "DELETE FROM transactions WHERE id = ("
+                        "SELECT id FROM transactions WHERE group_name = ? AND from_user = ? AND to_user = ? "
+                        "AND amount = ? AND category IS ? AND timestamp IS ? AND explanation IS ? LIMIT 1)",
+                        (group.name, edge["from"], edge["to"], edge["amount"],
+                         edge["category"], edge["timestamp"], edge["explanation"])
+                    )
+                # Deleting adds the reversing edge to the balance graph
+                self._sync_balance_edge(group, edge["to"], edge["from"])
+            elif op == "simplify_debts":
+                self._replace_balance_edges(group)
+            elif op == "apply_due":
+                ids = fields["ids"]
+                self.conn.executemany(
+                    "UPDATE transactions SET applied = 1 WHERE group_name = ? AND tx_id = ?",
+                    [(group.name, transaction_id) for transaction_id in ids]
+                )
+                entries = [group.graph.by_id[transaction_id] for transaction_id in ids]
+                for from_user, to_user in set((entry[2], entry[3]["to"]) for entry in entries):
+                    self._sync_balance_edge(group, from_user, to_user)
+            else:
+                raise ValueError(f"Unknown storage operation '{op}'.")
+
+    def import_groups(self, groups):
+        """Bulk-load in-memory groups, e.g. when migrating from the JSON snapshot."""
+        with self.lock, self.conn:
+            for name, group in groups.items():
+                self.conn.execute("INSERT INTO groups (name, next_id) VALUES (?, ?)", (name, group.graph.next_id))
+                self._insert_members(name, [member.name for member in group.members])
+                self._insert_transactions(group, [
+                    {"from": from_user, **transaction}
+                    for from_user, transaction in group.graph.iter_transactions()
+                ])
+                self._replace_balance_edges(group)
+
+    def _insert_members(self, group_name, names):
+        self.conn.executemany(
+            "INSERT OR IGNORE INTO members (group_name, name) VALUES (?, ?)",
+            [(group_name, name) for name in names]
+        )
+
+    def _insert_transactions(self, group, edges):
+        unapplied = group.graph.unapplied
+        self.conn.executemany(
+            "INSERT INTO transactions (group_name, tx_id, from_user, to_user, amount, currency, category, timestamp, "
+            "explanation, applied) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            [(group.name, edge["id"], edge["from"], edge["to"], edge["amount"], edge.get("currency"),
+              edge["category"], edge["timestamp"], edge["explanation"], edge["id"] not in unapplied) for edge in edges]
+        )
+
+    def _save_next_id(self, group):
+        self.conn.execute("UPDATE groups SET next_id = ? WHERE name = ?", (group.graph.next_id, group.name))
+
+    def _sync_balance_edge(self, group, from_user, to_user):
+        """Write the in-memory value of one balance edge back to the table."""
+        amount = group.graph.balance_graph.get_edge(from_user, to_user)
+        if amount is None:
+            self.conn.execute(
+                "DELETE FROM balance_edges WHERE group_name = ? AND from_user = ? AND to_user = ?",
+                (group.name, from_user, to_user)
+            )
+        else:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO balance_edges (group_name, from_user, to_user, amount) VALUES (?, ?, ?, ?)",
+                (group.name, from_user, to_user, amount)
+            )
+
+    def _replace_balance_edges(self, group):
+        self.conn.execute("DELETE FROM balance_edges WHERE group_name = ?", (group.name,))
+        self.conn.executemany(
+            "INSERT INTO balance_edges (group_name, from_user, to_user, amount) VALUES (?, ?, ?, ?)",
+            [(group.name, from_user, to_user, amount)
+             for from_user, to_user, amount in group.graph.balance_graph.edges()]
+        )
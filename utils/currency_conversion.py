@@ -1,23 +1,258 @@
+import json
+import os
+import threading
+import time
+from concurrent.futures import Future
 import requests
 
+
+class RatesUnavailable(Exception):
+    """Raised when no rate table can be had for a currency, fresh or stale."""
+
+
+class UnknownCurrency(RatesUnavailable, ValueError):
+    """Raised when the provider has no rates for a currency at all."""
+
+
+class ExchangeRateAPIProvider:
+    """Rate tables from exchangerate-api.com, one request per base currency."""
+
+    URL = "https://api.exchangerate-api.com/v4/latest/{base}"
+
+    def __init__(self, timeout=5, session=None):
+        self.timeout = timeout
+        self.session = session or requests.Session()  # Reuses connections between fetches
+
+    def fetch(self, base):
+        """Return {currency: units per 1 `base`} for every currency the API knows."""
+        try:
+            response = self.session.get(self.URL.format(base=base), timeout=self.timeout)
+        except requests.RequestException as e:
+            raise RatesUnavailable(f"Error fetching rates for {base}: {e}")
+        if response.status_code == 404:
+            raise UnknownCurrency(f"Unknown currency {base}.")
+        if response.status_code != 200:
+            raise RatesUnavailable(f"Error fetching rates for {base}: HTTP {response.status_code}")
+        try:
+            rates = response.json()["rates"]
+        except (ValueError, KeyError, TypeError):
+            raise RatesUnavailable(f"Error fetching rates for {base}: unexpected response.")
+        if not isinstance(rates, dict):
+            raise RatesUnavailable(f"Error fetching rates for {base}: unexpected response.")
+        return rates
+
+
+class FileRateProvider:
+    """
+    Rate tables from a local JSON file, for tests and deployments without
+    network access.
+
+    The file has the API's format, {"base": "USD", "rates": {"EUR": 0.92, ...}},
+    so a saved API response works. Tables for other bases are derived from it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def fetch(self, base):
+        try:
+            with open(self.path, "r") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            raise RatesUnavailable(f"Error reading rates from {self.path}: {e}")
+        try:
+            rates = {**data["rates"], data["base"]: 1}
+        except (KeyError, TypeError):
+            raise RatesUnavailable(f"Error reading rates from {self.path}: unexpected format.")
+        if base not in rates:
+            raise UnknownCurrency(f"Unknown currency {base}.")
+        try:
+            return {currency: rate / rates[base] for currency, rate in rates.items()}
+        except (TypeError, ZeroDivisionError):
+            raise RatesUnavailable(f"Error reading rates from {self.path}: invalid rate.")
+
+
+class ExchangeRates:
+    """
+    Currency conversion from whole rate tables, fetched once per base
+    currency and then served locally.
+
+    Tables are kept in memory and, if `directory` is given, on disk, for
+    `ttl` seconds. When a table has expired and the provider fails, the stale
+    table is used rather than failing the conversion. Failures, including
+    unknown currencies, are remembered for `miss_ttl` seconds, so the
+    provider isn't asked again for every conversion in the meantime.
+
+    Fetches run outside the lock: conversions from tables that are already
+    cached never wait for one, and concurrent requests for the same table
+    share a single fetch.
+    """
+
+    def __init__(self, provider, ttl=3600, directory=None, miss_ttl=60):
+        self.provider = provider
+        self.ttl = ttl
+        self.miss_ttl = miss_ttl
+        self.directory = directory
+        self.tables = {}  # base -> (fetched at, rates)
+        self.misses = {}  # base -> (failed at, RatesUnavailable)
+        self.fetching = {}  # base -> Future of the fetch in progress
+        self.fetches = 0
+        self.stale_uses = 0
+        self.lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    def _path(self, base):
+        return os.path.join(self.directory, f"{base}.json")
+
+    def table(self, base):
+        """
+        The rate table for `base` currency: {currency: units per 1 `base`}.
+
+        Raises:
+            UnknownCurrency: If the provider has no rates for `base`. It is
+                also a ValueError.
+            RatesUnavailable: If there is no table, not even a stale one.
+        """
+        with self.lock:
+            cached = self.tables.get(base)
+            if cached is None and self.directory:
+                cached = self._read_file(base)
+                if cached is not None:
+                    self.tables[base] = cached
+            now = time.time()
+            if cached is not None and now - cached[0] < self.ttl:
+                return cached[1]
+            miss = self.misses.get(base)
+            if miss is not None and now - miss[0] < self.miss_ttl:
+                if cached is None:
+                    raise miss[1]
+                self.stale_uses += 1
+                return cached[1]
+
+            fetch = self.fetching.get(base)
+            owner = fetch is None
+            if owner:
+                fetch = self.fetching[base] = Future()
+        if not owner:
+            return fetch.result()  # Another request is fetching this table already
+
+        try:
+            rates = self._fetch(base, cached)
+        except BaseException as e:
+            fetch.set_exception(e)
+            raise
+        else:
+            fetch.set_result(rates)
+            return rates
+        finally:
+            with self.lock:
+                del self.fetching[base]
+
+    def _fetch(self, base, cached):
+        """Fetch a table, falling back to the stale `cached` one if that fails."""
+        try:
+            rates = self.provider.fetch(base)
+        except RatesUnavailable as e:
+            with self.lock:
+                self.misses[base] = (time.time(), e)
+                if cached is None:
+                    raise
+                self.stale_uses += 1
+                return cached[1]
+
+        fetched = (time.time(), rates)
+        with self.lock:
+            self.fetches += 1
+            self.misses.pop(base, None)
+            self.tables[base] = fetched
+        if self.directory:
+            self._write_file(base, fetched)
+        return rates
+
+    def _read_file(self, base):
+        try:
+            with open(self._path(base), "r") as file:
+                data = json.load(file)
+            return data["fetched_at"], data["rates"]
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _write_file(self, base, cached):
+        path = self._path(base)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump({"base": base, "fetched_at": cached[0], "rates": cached[1]}, file)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass  # The disk copy is best effort
+
+    def rate(self, source_currency, target_currency):
+        """
+        Units of `target_currency` per 1 `source_currency`.
+
+        Raises:
+            ValueError: If either currency is unknown.
+        """
+        if source_currency == target_currency:
+            return 1.0
+        rate = self.table(source_currency).get(target_currency)
+        if rate is None:
+            raise ValueError("Invalid currency type provided.")
+        return rate
+
+    def convert(self, amount, source_currency, target_currency):
+        return amount * self.rate(source_currency, target_currency)
+
+    def convert_many(self, amounts, source_currencies, target_currency):
+        """
+        Convert many amounts to one currency, from one source currency (a
+        string) or one per amount (a list).
+
+        Only the target currency's table is needed, however many source
+        currencies there are: every rate is looked up in it and inverted.
+
+        Returns:
+            list: The converted amounts.
+        """
+        if isinstance(source_currencies, str):
+            source_currencies = [source_currencies] * len(amounts)
+        if all(currency == target_currency for currency in source_currencies):
+            return [amount * 1.0 for amount in amounts]
+
+        table = {**self.table(target_currency), target_currency: 1}
+        try:
+            inverse = {currency: 1 / table[currency] for currency in set(source_currencies)}
+        except KeyError:
+            raise ValueError("Invalid currency type provided.")
+        return [amount * inverse[currency] for amount, currency in zip(amounts, source_currencies)]
+
+    def stats(self):
+        with self.lock:
+            return {"tables": sorted(self.tables), "fetches": self.fetches, "stale_uses": self.stale_uses,
+                    "misses": sorted(self.misses), "ttl": self.ttl}
+
+
+def default_provider():
+    """A FileRateProvider if CURRENCY_RATES_FILE is set, otherwise the exchangerate-api.com provider."""
+    path = os.environ.get("CURRENCY_RATES_FILE")
+    if path:
+        return FileRateProvider(path)
+    return ExchangeRateAPIProvider(timeout=float(os.environ.get("CURRENCY_API_TIMEOUT", 5)))
+
+
+rates = ExchangeRates(
+    default_provider(),
+    ttl=float(os.environ.get("CURRENCY_RATES_TTL", 3600)),
+    miss_ttl=float(os.environ.get("CURRENCY_RATES_RETRY", 60)),
+    directory=os.environ.get("CURRENCY_CACHE_DIR"),  # Optional on-disk copy, which also survives restarts
+)
+
+
 def get_exchange_rate(source_currency, target_currency):
-    url = f"https://api.exchangerate-api.com/v4/latest/{source_currency}"
-    response = requests.get(url)
-    
-    if response.status_code != 200:
-        raise Exception("Error fetching data from the API")
-    
-    data = response.json()
-    return data['rates'].get(target_currency)
+    return rates.table(source_currency).get(target_currency)
 
-def convert_currency(source_currency, target_currency, amount):
-    # Get the exchange rate
-    exchange_rate = get_exchange_rate(source_currency, target_currency)
-    
-    if exchange_rate is None:
-        raise ValueError("Invalid currency type provided.")
-    
-    # Calculate the converted amount
-    converted_amount = amount * exchange_rate
-    return converted_amount
 
+def convert_currency(source_currency, target_currency, amount):
+    return rates.convert(amount, source_currency, target_currency)
@@ -0,0 +1,198 @@
+"""
+Image preprocessing before OCR.
+
+Tesseract's run time grows with the number of pixels, and a phone photo of a
+receipt is mostly background, at several times the resolution OCR needs. A
+Preprocessor crops the photo to the receipt, downsamples it to a target DPI
+and cleans it up, timing every stage.
+
+Compare settings on sample images (OCR time is included if Tesseract is installed):
+    python -m utils.image_preprocessing ["receipt samples"] [--dpi 300 200] [--binarize]
+"""
+import argparse
+import math
+import os
+import time
+import cv2
+import numpy as np
+from PIL import Image, ImageEnhance, ImageFilter
+
+RECEIPT_WIDTH_INCHES = 3.15  # 80 mm, the most common receipt paper width
+DETECTION_SIZE = 640         # Longest side of the reduced copy the receipt is detected on
+MIN_RECEIPT_AREA = 0.15      # Smaller bright regions are not taken for the receipt
+MAX_BRIGHT_BACKGROUND = 0.2  # Beyond this share of bright pixels around it, the region is no receipt
+CROP_MARGIN = 0.02           # Kept around the detected receipt, as a fraction of its size
+
+
+class Preprocessor:
+    """
+    Prepares a receipt photo for OCR in stages: grayscale, crop, resize,
+    enhance and binarize.
+
+    Args:
+        target_dpi: Resolution to downsample to, taking the receipt to be
+            RECEIPT_WIDTH_INCHES wide. Images are never upscaled. None keeps
+            the full resolution.
+        crop: Crop to the receipt, found as the largest bright region of the
+            photo on a darker background. Photos where none stands out, such
+            as scans and screenshots, are left as they are.
+        binarize: Convert to black and white with an adaptive threshold,
+            which copes with uneven lighting.
+        sharpen: Apply a sharpen filter.
+        contrast: Contrast enhancement factor; 1 leaves contrast unchanged.
+    """
+
+    STAGES = ("grayscale", "crop", "resize", "enhance", "binarize")
+
+    def __init__(self, target_dpi=300, crop=True, binarize=False, sharpen=True, contrast=2.0):
+        self.target_dpi = target_dpi
+        self.crop = crop
+        self.binarize = binarize
+        self.sharpen = sharpen
+        self.contrast = contrast
+
+    def key(self):
+        """The settings as a string, for cache keys."""
+        return f"dpi={self.target_dpi},crop={self.crop},binarize={self.binarize},sharpen={self.sharpen},contrast={self.contrast}"
+
+    def draft(self, image):
+        """
+        Let the JPEG decoder skip resolution the pipeline would discard. Call
+        it before the image is loaded; it does nothing for other formats.
+
+        The receipt is taken to be at least half as wide as the photo, so
+        cropping still leaves it at the target DPI or more.
+        """
+        if not self.target_dpi or image.format != "JPEG":
+            return
+        scale = 2 * RECEIPT_WIDTH_INCHES * self.target_dpi / image.width
+        if scale < 1:
+            image.draft("L", (math.ceil(image.width * scale), math.ceil(image.height * scale)))
+
+    def __call__(self, image, timings=None):
+        """
+        Run the pipeline on a PIL image.
+
+        Args:
+            timings (dict): If given, receives the seconds spent per stage.
+
+        Returns:
+            Image: The preprocessed grayscale image.
+        """
+        timings = {} if timings is None else timings
+        for stage in self.STAGES:
+            start = time.perf_counter()
+            image = getattr(self, f"_{stage}")(image)
+            timings[stage] = time.perf_counter() - start
+        return image
+
+    def _grayscale(self, image):
+        return image.convert("L")
+
+    def _crop(self, image):
+        if not self.crop:
+            return image
+        box = find_receipt(image)
+        return image.crop(box) if box else image
+
+    def _resize(self, image):
+        if not self.target_dpi:
+            return image
+        width = round(RECEIPT_WIDTH_INCHES * self.target_dpi)
+        if image.width <= width:
+            return image
+        height = max(1, round(image.height * width / image.width))
+        # reducing_gap first shrinks by an integer factor, which is much faster than resampling it all
+        return image.resize((width, height), Image.LANCZOS, reducing_gap=3.0)
+
+    def _enhance(self, image):
+        if self.sharpen:
+            image = image.filter(ImageFilter.SHARPEN)
+        if self.contrast != 1:
+            image = ImageEnhance.Contrast(image).enhance(self.contrast)
+        return image
+
+    def _binarize(self, image):
+        if not self.binarize:
+            return image
+        pixels = cv2.adaptiveThreshold(np.asarray(image), 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY, 31, 15)
+        return Image.fromarray(pixels)
+
+
+def find_receipt(image):
+    """
+    Find the receipt in a grayscale photo.
+
+    Detection runs on a copy reduced to about DETECTION_SIZE pixels: the paper
+    is separated from the background with Otsu's threshold, closed over the
+    text, and the bounding box of its largest region is scaled back up.
+
+    Returns:
+        tuple: The (left, top, right, bottom) box, or None if no region
+        between MIN_RECEIPT_AREA and almost all of the photo stands out from
+        a mostly dark background.
+    """
+    factor = max(1, max(image.size) // DETECTION_SIZE)
+    small = np.asarray(image.reduce(factor))
+    blurred = cv2.GaussianBlur(small, (5, 5), 0)
+    _, mask = cv2.threshold(blurred, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    mask = cv2.morphologyEx(mask, cv2.MORPH_CLOSE, np.ones((15, 15), np.uint8))
+    contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    if not contours:
+        return None
+
+    x, y, width, height = cv2.boundingRect(max(contours, key=cv2.contourArea))
+    area = small.shape[0] * small.shape[1]
+    if not MIN_RECEIPT_AREA * area <= width * height <= 0.95 * area:
+        return None
+    # A white page with a light region in it (a document, a screenshot) has no background to crop
+    bright_outside = np.count_nonzero(mask) - np.count_nonzero(mask[y:y + height, x:x + width])
+    if bright_outside > MAX_BRIGHT_BACKGROUND * (area - width * height):
+        return None
+    margin_x, margin_y = round(width * CROP_MARGIN), round(height * CROP_MARGIN)
+    return (
+        max(0, (x - margin_x) * factor),
+        max(0, (y - margin_y) * factor),
+        min(image.width, (x + width + margin_x) * factor),
+        min(image.height, (y + height + margin_y) * factor),
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the preprocessing stages and OCR on sample images.")
+    parser.add_argument("directory", nargs="?", default="receipt samples")
+    parser.add_argument("--dpi", type=int, nargs="+", default=[300, 200], help="Target DPIs to compare")
+    parser.add_argument("--no-crop", action="store_true")
+    parser.add_argument("--binarize", action="store_true")
+    args = parser.parse_args(argv)
+
+    import utils.receipt_scanner as scanner
+
+    configs = {"full resolution": Preprocessor(target_dpi=None, crop=False)}
+    for dpi in args.dpi:
+        configs[f"{dpi} dpi"] = Preprocessor(target_dpi=dpi, crop=not args.no_crop, binarize=args.binarize)
+
+    for filename in sorted(os.listdir(args.directory)):
+        try:
+            original = scanner.load_image(os.path.join(args.directory, filename))
+            original.load()  # Full resolution, as drafts differ between settings
+        except Exception as e:
+            print(f"Skipping {filename}: {e}")
+            continue
+        print(f"{filename} ({original.width}x{original.height})")
+        for name, preprocessor in configs.items():
+            timings = {}
+            image = preprocessor(original, timings)
+            stages = " ".join(f"{stage} {seconds * 1000:.0f}" for stage, seconds in timings.items())
+            line = f"  {name:16} {image.width}x{image.height} ms: {stages}"
+            try:
+                start = time.perf_counter()
+                text = scanner.ocr_image(image)
+                line += f" ocr {(time.perf_counter() - start) * 1000:.0f} ({len(text.split())} words)"
+            except Exception:
+                pass  # No OCR engine installed
+            print(line)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+import threading
+from collections import OrderedDict
+import utils.receipt_scanner as scanner
+
+
+def cache_key(image_bytes):
+    """Content address of a scan: the image bytes plus the OCR engine and settings that affect the text."""
+    digest = hashlib.sha256(image_bytes)
+    digest.update(f"\0{scanner.OCR_LANG}\0{scanner.OCR_CONFIG}\0{scanner.PREPROCESSOR.key()}\0{scanner.OCR_BACKEND.name}".encode())
+    return digest.hexdigest()
+
+
+class OCRCache:
+    """
+    Two-tier cache of scan results (as returned by scanner.scan_image).
+
+    The memory tier is an LRU of at most `capacity` entries. If `directory`
+    is given, entries are also written there as one JSON file each, and the
+    least recently used files are removed once they take up more than
+    `max_disk_bytes`.
+    """
+
+    def __init__(self, capacity=256, directory=None, max_disk_bytes=64 * 1024 * 1024):
+        self.capacity = capacity
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.entries = OrderedDict()
+        self.disk_sizes = {}  # key -> file size
+        self.disk_bytes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for filename in os.listdir(directory):
+                if filename.endswith(".json"):
+                    size = os.path.getsize(os.path.join(directory, filename))
+                    self.disk_sizes[filename[:-len(".json")]] = size
+                    self.disk_bytes += size
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + ".json")
+
+    def get(self, key):
+        """Return the cached entry for `key`, or None."""
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+                self.memory_hits += 1
+                return entry
+
+            if key in self.disk_sizes:
+                try:
+                    with open(self._path(key), "r") as file:
+                        entry = json.load(file)
+                    os.utime(self._path(key))  # The modification time orders disk eviction
+                except (OSError, ValueError):
+                    self._remove_file(key)
+                else:
+                    self.disk_hits += 1
+                    self._remember(key, entry)
+                    return entry
+
+            self.misses += 1
+            return None
+
+    def put(self, key, entry):
+        with self.lock:
+            self._remember(key, entry)
+            if self.directory and key not in self.disk_sizes:
+                self._write_file(key, entry)
+
+    def _remember(self, key, entry):
+        self.entries[key] = entry
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def _write_file(self, key, entry):
+        path = self._path(key)
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w") as file:
+                json.dump(entry, file)
+            os.replace(tmp_path, path)
+        except OSError:
+            return  # The disk tier is best effort
+        size = os.path.getsize(path)
+        self.disk_sizes[key] = size
+        self.disk_bytes += size
+
+        if self.disk_bytes > self.max_disk_bytes:
+            # Evict down to 90% of the budget, so the sort below doesn't run on every write
+            by_age = sorted(self.disk_sizes, key=self._mtime)
+            for cached in by_age:
+                if self.disk_bytes <= self.max_disk_bytes * 0.9:
+                    break
+                self._remove_file(cached)
+
+    def _mtime(self, key):
+        try:
+            return os.path.getmtime(self._path(key))
+        except OSError:
+            return 0
+
+    def _remove_file(self, key):
+        self.disk_bytes -= self.disk_sizes.pop(key, 0)
+        try:
+            os.remove(self._path(key))
+        except OSError:
+            pass
+
+    def stats(self):
+        with self.lock:
+            lookups = self.memory_hits + self.disk_hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "capacity": self.capacity,
+                "disk_entries": len(self.disk_sizes),
+                "disk_bytes": self.disk_bytes,
+                "max_disk_bytes": self.max_disk_bytes if self.directory else None,
+                "memory_hits": self.memory_hits,
+                "disk_hits": self.disk_hits,
+                "misses": self.misses,
+                "hit_rate": (self.memory_hits + self.disk_hits) / lookups if lookups else 0.0,
+            }
@@ -0,0 +1,272 @@
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import Future, ProcessPoolExecutor, TimeoutError, as_completed, wait
+from concurrent.futures.process import BrokenProcessPool
+import utils.receipt_parser as receipt_parser
+import utils.receipt_scanner as scanner
+from utils.ocr_cache import cache_key
+
+KINDS = ("receipt", "payment")
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class ScanFailed(Exception):
+    """A worker's scan error, as a plain exception that always pickles back to the parent."""
+
+
+def timed_scan(image):
+    """Run scanner.scan_image in a worker process. Returns (scan, {stage: seconds spent})."""
+    timings = {}
+    start = time.perf_counter()
+    try:
+        scan = scanner.scan_image(image, timings)
+    except scanner.InvalidImage:
+        raise  # Already plain, and the app answers it with a client error
+    except Exception as e:
+        # Some errors (e.g. pytesseract's TesseractNotFoundError) fail to unpickle, which breaks the whole pool
+        raise ScanFailed(f"{type(e).__name__}: {e}") from None
+    timings["total"] = time.perf_counter() - start
+    return scan, timings
+
+
+def job_result(kind, scan, options):
+    """
+    Parse a job's scan (see scanner.scan_image) into its result.
+
+    Parsing happens here rather than in the worker, so one cached scan serves
+    every grammar and name.
+    """
+    text = scan["text"]
+    if kind == "receipt":
+        return receipt_parser.parse(text, options.get("grammar") or "restaurant")
+    amount = receipt_parser.parse(text, "payment")["amount"]
+    return amount, receipt_parser.contains_name(text, options.get("name") or "")
+
+
+class OCRJobQueue:
+    """
+    Runs receipt OCR in a pool of worker processes so it never blocks request handlers.
+
+    `submit` returns a job ID immediately and `get` reports the job's status,
+    optionally waiting for it to finish. At most `max_queued` unfinished jobs
+    are accepted; beyond that `submit` raises QueueFull. A job that isn't done
+    `timeout` seconds after submission is reported as timed out. A job that
+    hasn't started yet is cancelled, but one that is already running keeps its
+    worker busy until Tesseract returns. Finished jobs are forgotten after
+    `result_ttl` seconds.
+
+    With a `cache` (OCRCache), images that were scanned before are answered
+    from it without using a worker, and every finished scan is added to it.
+
+    Workers keep their OCR engine loaded between jobs. With
+    `max_jobs_per_worker`, the pool is replaced by a fresh one after about
+    that many jobs per worker, to release whatever memory the engines and
+    workers accumulated. The old pool finishes its jobs before it exits.
+
+    If a worker dies (out of memory, a crash in the OCR engine), the jobs of
+    its pool fail and the next submission starts a new pool.
+    """
+
+    def __init__(self, max_workers=None, max_queued=32, timeout=60, result_ttl=600, cache=None,
+                 max_jobs_per_worker=None):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.max_queued = max_queued
+        self.timeout = timeout
+        self.result_ttl = result_ttl
+        self.cache = cache
+        self.max_jobs_per_worker = max_jobs_per_worker
+        self.executor = None  # Created on first use so importing the app doesn't spawn processes
+        self.executor_jobs = 0
+        self.recycled = 0
+        self.broken = 0
+        self.jobs = {}
+        self.rejected = 0
+        self.scanned = 0
+        self.stage_seconds = defaultdict(float)  # Summed over scanned images
+        self.lock = threading.Lock()
+
+    def submit(self, kind, image, **options):
+        """Queue an OCR job for the image bytes and return its ID."""
+        if kind not in KINDS:
+            raise ValueError(f"Unknown OCR job kind '{kind}'.")
+        key = cache_key(image) if self.cache is not None else None
+        scan = self.cache.get(key) if key is not None else None
+
+        with self.lock:
+            self._expire()
+            if scan is not None:
+                future = Future()
+                future.set_result((scan, {}))
+            else:
+                if self._unfinished() >= self.max_queued:
+                    self.rejected += 1
+                    raise QueueFull(f"Too many OCR jobs in progress (limit {self.max_queued}).")
+                try:
+                    future = self._executor().submit(timed_scan, image)
+                except BrokenProcessPool:
+                    # A broken pool refuses every job, so replace it
+                    self.executor.shutdown(wait=False)
+                    self.executor = None
+                    self.broken += 1
+                    future = self._executor().submit(timed_scan, image)
+                self.executor_jobs += 1
+
+            job_id = uuid.uuid4().hex
+            self.jobs[job_id] = {
+                "id": job_id,
+                "kind": kind,
+                "options": options,
+                "submitted": time.time(),
+                "finished": None,
+                "timed_out": False,
+                "cached": scan is not None,
+                "future": future,
+            }
+
+        if scan is None:
+            # Outside the lock, as the callback runs right away if the scan is already done
+            future.add_done_callback(lambda done: self._finish_scan(key, done))
+        return job_id
+
+    def _executor(self):
+        """The current pool, replaced first if it has run its share of jobs."""
+        if self.executor is not None and self.max_jobs_per_worker \
+                and self.executor_jobs >= self.max_jobs_per_worker * self.max_workers:
+            # Without cancel_futures, the old pool still runs the jobs it was given
+            self.executor.shutdown(wait=False)
+            self.executor = None
+            self.recycled += 1
+        if self.executor is None:
+            # Python 3.10 has no max_tasks_per_child, hence replacing whole pools
+            self.executor = ProcessPoolExecutor(max_workers=self.max_workers, initializer=scanner.init_worker)
+            self.executor_jobs = 0
+        return self.executor
+
+    def _finish_scan(self, key, future):
+        if future.cancelled() or future.exception() is not None:
+            return
+        scan, timings = future.result()
+        with self.lock:
+            self.scanned += 1
+            for stage, seconds in timings.items():
+                self.stage_seconds[stage] += seconds
+        if key is not None:
+            self.cache.put(key, scan)
+
+    def get(self, job_id, wait_seconds=0):
+        """
+        Return the status of a job, or None if it is unknown or expired.
+
+        With `wait_seconds`, block until the job finishes or the wait ends,
+        whichever comes first (long polling).
+        """
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+
+        if wait_seconds > 0 and not job["timed_out"]:
+            remaining = job["submitted"] + self.timeout - time.time()
+            wait([job["future"]], timeout=max(0, min(wait_seconds, remaining)))
+
+        with self.lock:
+            self._check(job)
+            return self._status(job)
+
+    def as_completed(self, job_ids):
+        """Yield the status of each of the given jobs as soon as it finishes or times out."""
+        with self.lock:
+            jobs = {self.jobs[job_id]["future"]: self.jobs[job_id] for job_id in job_ids if job_id in self.jobs}
+        if not jobs:
+            return
+        deadline = max(job["submitted"] for job in jobs.values()) + self.timeout
+        try:
+            for future in as_completed(jobs, timeout=max(0, deadline - time.time())):
+                job = jobs.pop(future)
+                with self.lock:
+                    self._check(job)
+                    status = self._status(job)
+                yield status
+        except TimeoutError:
+            pass
+        # Whatever is left has passed its deadline
+        for job in jobs.values():
+            with self.lock:
+                self._check(job)
+                status = self._status(job)
+            yield status
+
+    def available(self):
+        """Number of jobs that can be submitted before the queue is full."""
+        with self.lock:
+            return max(0, self.max_queued - self._unfinished())
+
+    def wait_result(self, job_id):
+        """Block until a job finishes or times out. Returns its status."""
+        return self.get(job_id, wait_seconds=self.timeout)
+
+    def stats(self):
+        with self.lock:
+            statuses = [self._status(job)["status"] for job in self.jobs.values()]
+            return {
+                "workers": self.max_workers,
+                "backend": scanner.OCR_BACKEND.name,
+                "recycled_pools": self.recycled,
+                "broken_pools": self.broken,
+                "max_queued": self.max_queued,
+                "unfinished": self._unfinished(),
+                "rejected": self.rejected,
+                "scanned": self.scanned,
+                "mean_stage_ms": {stage: seconds / self.scanned * 1000 for stage, seconds in self.stage_seconds.items()},
+                **{status: statuses.count(status) for status in ("queued", "running", "done", "failed", "timeout")},
+            }
+
+    def shutdown(self):
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def _check(self, job):
+        """Mark the job as timed out once its deadline passed."""
+        future = job["future"]
+        if future.done():
+            if job["finished"] is None:
+                job["finished"] = time.time()
+        elif not job["timed_out"] and time.time() - job["submitted"] > self.timeout:
+            job["timed_out"] = True
+            job["finished"] = time.time()
+            future.cancel()
+
+    def _status(self, job):
+        status = {"id": job["id"], "kind": job["kind"]}
+        future = job["future"]
+        if job["timed_out"]:
+            status.update(status="timeout", error=f"OCR did not finish within {self.timeout} seconds.")
+        elif future.done():
+            error = future.exception()
+            if error is None:
+                scan, timings = future.result()
+                status.update(status="done", result=job_result(job["kind"], scan, job["options"]),
+                              cached=job["cached"], ocr_seconds=timings.get("total", 0.0), timings=timings)
+            else:
+                status.update(status="failed", error=str(error),
+                              invalid_image=isinstance(error, scanner.InvalidImage))
+        else:
+            status["status"] = "running" if future.running() else "queued"
+        return status
+
+    def _unfinished(self):
+        # Timed out jobs that are still running occupy a worker, so they count too
+        return sum(1 for job in self.jobs.values() if not job["future"].done())
+
+    def _expire(self):
+        now = time.time()
+        for job in list(self.jobs.values()):
+            self._check(job)
+            if job["finished"] is not None and now - job["finished"] > self.result_ttl:
+                del self.jobs[job["id"]]
@@ -0,0 +1,196 @@
+"""
+Parsing of receipt OCR text.
+
+Each kind of receipt has a Grammar: a few line rules, combined into one
+regular expression compiled at import, and a handler per rule. Parsing walks
+the text once with that expression, so every line is matched a single time
+however many rules there are. Grammars are registered by name and chosen per
+scan request.
+
+Micro-benchmark (OCRs the images once, then times only the parsing):
+    python -m utils.receipt_parser ["receipt samples"] [-n iterations]
+"""
+import argparse
+import os
+import re
+import sys
+import time
+from functools import lru_cache
+
+GRAMMARS = {}
+
+# Horizontal whitespace. Rules use it instead of \s so a match can't run into the next line.
+_WS = r"[^\S\n]*"
+_TAX = rf"tax\b{_WS}:?{_WS}(?:\d+(?:\.\d+)?%{_WS})?\$?(?P<tax_amount>\d+(?:\.\d+)?)"
+_TOTALS = r"(?:sub[^\S\n]?total|total|balance|change|amount due|tip|gratuity)\b"
+
+
+class Grammar:
+    """
+    Parses the OCR text of one kind of receipt.
+
+    Rules are (rule name, regex, handler) tuples. `keywords` rules match at
+    the start of any word of a line and `lines` rules at the start of a line.
+    A line is matched by the first keyword rule found in it, or else by the
+    first line rule, in list order. Keyword rules share a single scan of the
+    line, which is what makes adding them cheap. Group names must be unique
+    across all rules of a grammar.
+
+    For every match, the handler is called with the result so far (a fresh
+    one from `start`) and the match, and can return True to stop parsing.
+    """
+
+    def __init__(self, name, kind, start, keywords=(), lines=()):
+        self.name = name
+        self.kind = kind  # The OCR job kind whose results this grammar produces
+        self.start = start
+        self.handlers = {rule: handler for rule, _, handler in [*keywords, *lines]}
+
+        def alternatives(rules):
+            return "|".join(f"(?P<{rule}>{regex})" for rule, regex, _ in rules)
+
+        branches = [alternatives(lines)] if lines else []
+        if keywords:
+            branches.insert(0, rf"[^\n]*?\b(?:{alternatives(keywords)})")
+        self.pattern = re.compile(f"^(?:{'|'.join(branches)})", re.IGNORECASE | re.MULTILINE)
+
+    def parse(self, text):
+        result = self.start()
+        for match in self.pattern.finditer(text):
+            # The rule's group encloses all others, so it is the last one to close
+            if self.handlers[match.lastgroup](result, match):
+                break
+        return result
+
+
+def register(grammar):
+    GRAMMARS[grammar.name] = grammar
+    return grammar
+
+
+def grammar_names(kind):
+    """Names of the registered grammars for an OCR job kind."""
+    return [name for name, grammar in GRAMMARS.items() if grammar.kind == kind]
+
+
+def parse(text, grammar):
+    """
+    Parse OCR text with the named grammar.
+
+    Raises:
+        ValueError: If no grammar of that name is registered.
+    """
+    if grammar not in GRAMMARS:
+        raise ValueError(f"Unknown receipt grammar '{grammar}'.")
+    return GRAMMARS[grammar].parse(text)
+
+
+@lru_cache(maxsize=256)
+def _name_pattern(name):
+    return re.compile(re.escape(name), re.IGNORECASE)
+
+
+def contains_name(text, name):
+    """Whether `name` appears in the text, ignoring case. An empty name is never found."""
+    return bool(name) and _name_pattern(name).search(text) is not None
+
+
+def _items_and_tax():
+    return {"items": [], "tax": None}
+
+
+def _tax(result, match):
+    result["tax"] = {"amount": float(match["tax_amount"])}
+
+
+def _skip(result, match):
+    pass
+
+
+def _restaurant_item(result, match):
+    result["items"].append({
+        "name": match["item_name"].strip(),
+        "quantity": int(match["item_quantity"]),
+        "cost": float(match["item_cost"]),
+    })
+
+
+# Lines such as "2 Burger $12.00" or "1 × Coke 2.50": a quantity, a name and a cost
+register(Grammar("restaurant", "receipt", _items_and_tax, keywords=[
+    ("tax", _TAX, _tax),
+    ("totals", _TOTALS, _skip),
+], lines=[
+    ("item", rf"[^\d\n]*(?P<item_quantity>\d+){_WS}[×*]?{_WS}(?P<item_name>[^\n]*?[a-z][^\n]*?){_WS}[@$]?{_WS}(?P<item_cost>\d+\.\d{{2}})", _restaurant_item),
+]))
+
+
+def _grocery_item(result, match):
+    result["items"].append({"name": match["item_name"].strip(), "quantity": 1, "cost": float(match["item_cost"])})
+
+
+def _grocery_multiple(result, match):
+    # "2 @ 0.99" under an item gives its quantity; the item line already has the total cost
+    if result["items"]:
+        result["items"][-1]["quantity"] = int(match["multiple_quantity"])
+
+
+# Lines such as "BANANAS 1.98" (the cost is for the whole line), optionally
+# followed by a "2 @ 0.99" line. Weighed items ("1.25 lb @ 0.99/lb") are skipped.
+register(Grammar("grocery", "receipt", _items_and_tax, keywords=[
+    ("tax", _TAX, _tax),
+    ("totals", _TOTALS, _skip),
+], lines=[
+    ("weight", rf"{_WS}\d+(?:\.\d+)?{_WS}(?:lb|lbs|kg|g|oz)\b", _skip),
+    ("multiple", rf"{_WS}(?P<multiple_quantity>\d+){_WS}[@x×*]{_WS}\$?\d+\.\d{{2}}", _grocery_multiple),
+    ("item", rf"{_WS}(?P<item_name>[^\n]*?[a-z][^\n]*?){_WS}\$?(?P<item_cost>\d+\.\d{{2}})\b", _grocery_item),
+]))
+
+
+def _payment_amount(result, match):
+    result["amount"] = match["amount_value"]
+    return True  # The first amount is the one that was paid
+
+
+# The amount after the first "Total" or "Amount", which may be on the next line
+register(Grammar("payment", "payment", lambda: {"amount": None}, keywords=[
+    ("amount", r"(?:total|amount)\b:?\s*\$?(?P<amount_value>(?:\d{1,3}(?:,\d{3})+|\d+)(?:\.\d{2})?)", _payment_amount),
+]))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the receipt grammars on OCR text of sample images.")
+    parser.add_argument("directory", nargs="?", default="receipt samples",
+                        help="Images to OCR, or .txt files of OCR text (default: 'receipt samples')")
+    parser.add_argument("-n", "--iterations", type=int, default=1000, help="Parses per receipt and grammar")
+    args = parser.parse_args(argv)
+
+    import utils.receipt_scanner as scanner
+
+    texts = []
+    for filename in sorted(os.listdir(args.directory)):
+        path = os.path.join(args.directory, filename)
+        if filename.endswith(".txt"):
+            with open(path, "r") as file:
+                texts.append(file.read())
+        else:
+            try:
+                texts.append(scanner.scan_image(path)["text"])
+            except Exception as e:
+                print(f"Skipping {filename}: {e}", file=sys.stderr)
+    if not texts:
+        parser.error(f"No receipts could be read from '{args.directory}'.")
+
+    lines = sum(text.count("\n") + 1 for text in texts)
+    print(f"{len(texts)} receipts, {lines} lines, {args.iterations} iterations")
+    for name, grammar in GRAMMARS.items():
+        start = time.perf_counter()
+        for _ in range(args.iterations):
+            for text in texts:
+                grammar.parse(text)
+        seconds = time.perf_counter() - start
+        receipts = len(texts) * args.iterations
+        print(f"{name:12} {seconds / receipts * 1e6:8.1f} µs/receipt {lines * args.iterations / seconds:12,.0f} lines/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,183 @@
-import re
+import io
 import os
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
 import pytesseract
-from PIL import Image, ImageEnhance, ImageFilter
+from PIL import Image
+try:
+    import tesserocr
+    HAS_TESSEROCR = True
+except ImportError:
+    tesserocr = None
+    HAS_TESSEROCR = False
+import utils.receipt_parser as receipt_parser
+from utils.image_preprocessing import Preprocessor
 
-def process_expense_receipt(image_path):
+# When set, every scanned image and its preprocessed version are written to
+# this directory for debugging. Nothing touches the disk otherwise.
+DEBUG_DIR = os.environ.get("RECEIPT_DEBUG_DIR")
+
+# OCR settings. They are part of the OCR cache key, as are the preprocessing settings.
+OCR_LANG = "eng"
+OCR_PSM = 6  # A single uniform block of text
+OCR_CONFIG = f"--psm {OCR_PSM}"
+
+# Lower DPIs make OCR faster at some cost in accuracy; RECEIPT_TARGET_DPI=0 keeps full resolution
+PREPROCESSOR = Preprocessor(
+    target_dpi=int(os.environ.get("RECEIPT_TARGET_DPI", 300)) or None,
+    crop=os.environ.get("RECEIPT_CROP", "1") == "1",
+    binarize=os.environ.get("RECEIPT_BINARIZE", "0") == "1",
+)
+
+
+class InvalidImage(ValueError):
+    """Raised by scan_image when the upload can't be decoded as an image."""
+
+
+class PytesseractBackend:
+    """
+    OCR through pytesseract, which runs the tesseract program once per image.
+    Every call pays for starting a process, writing the image to a temporary
+    file and loading the language data.
+    """
+
+    name = "pytesseract"
+
+    def start(self):
+        pass
+
+    def image_to_string(self, image):
+        return pytesseract.image_to_string(image, lang=OCR_LANG, config=OCR_CONFIG)
+
+
+class TesserocrBackend:
+    """
+    OCR through tesserocr, with one Tesseract engine that stays initialized
+    for the life of the process and takes images in memory.
+    """
+
+    name = "tesserocr"
+
+    def __init__(self):
+        self.api = None
+        self.lock = threading.Lock()  # An engine handles one image at a time
+
+    def start(self):
+        with self.lock:
+            if self.api is None:
+                self.api = tesserocr.PyTessBaseAPI(lang=OCR_LANG, psm=OCR_PSM)
+
+    def image_to_string(self, image):
+        self.start()
+        with self.lock:
+            self.api.SetImage(image)
+            return self.api.GetUTF8Text()
+
+
+OCR_BACKENDS = {"pytesseract": PytesseractBackend, "tesserocr": TesserocrBackend}
+
+
+def make_backend(name):
+    """
+    Create the named OCR backend. "auto" picks tesserocr when it is
+    installed and falls back to pytesseract.
+
+    Raises:
+        ValueError: For an unknown or unavailable backend.
+    """
+    if name == "auto":
+        name = "tesserocr" if HAS_TESSEROCR else "pytesseract"
+    if name not in OCR_BACKENDS:
+        raise ValueError(f"Unknown OCR backend '{name}'.")
+    if name == "tesserocr" and not HAS_TESSEROCR:
+        raise ValueError("The tesserocr OCR backend needs the tesserocr package.")
+    return OCR_BACKENDS[name]()
+
+
+OCR_BACKEND = make_backend(os.environ.get("OCR_BACKEND", "auto"))
+
+
+def ocr_image(image):
+    """Run OCR on a preprocessed PIL image with OCR_BACKEND and return the text."""
+    return OCR_BACKEND.image_to_string(image)
+
+
+def init_worker():
+    """Process pool initializer: get the OCR engine ready before the first job arrives."""
+    OCR_BACKEND.start()
+
+
+def load_image(image):
+    """
+    Open a receipt image from bytes, a file-like object or a path.
+
+    Bytes and file-like objects (e.g. an upload's stream) are decoded in memory.
+    """
+    if isinstance(image, Image.Image):
+        return image
+    if isinstance(image, (bytes, bytearray, memoryview)):
+        image = io.BytesIO(image)
+    return Image.open(image)
+
+
+def save_debug_image(image, stage):
+    """Write an image to DEBUG_DIR, if debugging is enabled."""
+    if not DEBUG_DIR:
+        return
+    os.makedirs(DEBUG_DIR, exist_ok=True)
+    image.save(os.path.join(DEBUG_DIR, f"{time.time_ns()}_{stage}.png"))
+
+
+def process_expense_receipt(image):
     """
-    Processes a receipt image from the given path.
+    Processes a receipt image.
 
     Args:
-        image (PIL.Image): The receipt image.
+        image: The receipt image as bytes, a file-like object or a path.
 
     Returns:
         dict: A dictionary containing the extracted receipt details.
     """
     
-    if not image_path:
+    if image is None:
         return {"error": "No image provided for OCR processing."}
     
     try:
         # Process the image
-        result = extract_receipt_details(image_path)
+        result = extract_receipt_details(image)
         if isinstance(result, tuple) and "error" in result[0]:
             return result[0]  # Propagate OCR or extraction error
         
     except Exception as e:
         return f"Error processing the image: {str(e)}"
-    finally:
-        # Cleanup temporary file if created
-        if image_path and os.path.exists(image_path) and not os.path.isabs(image_path):
-            os.remove(image_path)
 
     return result
 
-def extract_receipt_details(image_path):
+def process_expense_receipts(images, max_workers=None):
+    """
+    Processes many receipt images in parallel, in a pool with one process per core by default.
+
+    Args:
+        images: Receipt images as bytes, file-like objects or paths.
+        max_workers (int): Size of the process pool.
+
+    Yields:
+        tuple: (index into `images`, result of process_expense_receipt), as each receipt finishes.
+    """
+    # File-like objects can't be sent to other processes, so read them here
+    images = [image.read() if hasattr(image, "read") else image for image in images]
+    with ProcessPoolExecutor(max_workers=max_workers or os.cpu_count(), initializer=init_worker) as executor:
+        futures = {executor.submit(process_expense_receipt, image): index for index, image in enumerate(images)}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def extract_receipt_details(image):
     """
     Extracts food items, quantities, costs, and tax from a restaurant receipt.
 
     Args:
-        image (PIL.Image): The receipt image.
+        image: The receipt image as bytes, a file-like object or a path.
 
     Returns:
         dict: A dictionary containing items, quantities, and costs, along with tax.
@@ -45,119 +185,130 @@ def extract_receipt_details(image_path):
     Raises:
         ValueError: If OCR processing or data extraction fails.
     """
-    if not image_path:
+    if image is None:
         return {"error": "No image provided for OCR processing."}
 
     try:
         # Preprocess the image
-        image = preprocess_image(image_path)
+        image = preprocess_image(image)
         if isinstance(image, dict) and "error" in image:
             return image  # Propagate preprocessing error
         
         # Perform OCR
         try:
-            text = pytesseract.image_to_string(image, lang='eng', config="--psm 6")
+            text = ocr_image(image)
         except Exception as ocr_error:
             return {"error": f"OCR failed: {str(ocr_error)}"}
-        
-        # Normalize and split the text into lines
-        lines = text.strip().split("\n")
-        if not lines:
-            return {"error": "No text found in the image after OCR."}
-
-        items = []
-        tax = None
-
-        # Regular expressions for extracting data
-        item_regex = re.compile(r"(\d+)\s*[×*]?\s*(.+?)\s*[@\$]?\s*(\d+\.\d{2})")
-        tax_regex = re.compile(r"TAX[:\s]+([$]?)([\d.]+)", re.IGNORECASE)
-
-        for line in lines:
-            # Check for items
-            item_match = item_regex.search(line)
-            if item_match:
-                try:
-                    quantity = int(item_match.group(1))
-                    name = item_match.group(2).strip()
-                    cost = float(item_match.group(3))
-                    items.append({"name": name, "quantity": quantity, "cost": cost})
-                except (ValueError, IndexError):
-                    return {"error": f"Failed to parse item data: '{line}'"}
-            
-            # Check for tax
-            tax_match = tax_regex.search(line)
-            if tax_match:
-                try:
-                    tax = {"amount": float(tax_match.group(2))}
-                except ValueError:
-                    return {"error": f"Failed to parse tax value from line: '{line}'"}
-
-        return {
-            "items": items,
-            "tax": tax,
-        }
+
+        return parse_receipt_text(text)
     except Exception as e:
         return {"error": f"Unexpected error during receipt processing: {str(e)}"}
 
 
+def parse_receipt_text(text, grammar="restaurant"):
+    """
+    Extracts items, quantities, costs, and tax from the OCR text of a receipt.
 
-def preprocess_image(image_path):
+    Args:
+        text: The OCR text.
+        grammar: The receipt_parser grammar to parse it with.
+
+    Returns:
+        dict: Items and tax.
+    """
+    return receipt_parser.parse(text, grammar)
+
+
+def preprocess_image(image, timings=None):
     """
-    Preprocess the image for better OCR accuracy.
+    Preprocess the image for better and faster OCR, with PREPROCESSOR.
 
     Args:
-        image (PIL.Image): The image to preprocess.
+        image: The image to preprocess, as a PIL image, bytes, a file-like object or a path.
+        timings (dict): If given, receives the seconds spent per preprocessing stage.
 
     Returns:
         Image: The preprocessed PIL image.
 
     Raises:
-        ValueError: If the input is not a valid PIL image.
+        PIL.UnidentifiedImageError: If the input is not a valid image.
     """
 
-    image = Image.open(image_path)
-    # Convert to grayscale
-    image = image.convert("L")
-    # Apply a sharpen filter
-    image = image.filter(ImageFilter.SHARPEN)
-    # Enhance contrast
-    enhancer = ImageEnhance.Contrast(image)
-    image = enhancer.enhance(2)
+    image = load_image(image)
+    PREPROCESSOR.draft(image)
+    save_debug_image(image, "original")
+    image = PREPROCESSOR(image, timings)
+    save_debug_image(image, "preprocessed")
     return image
 
 
-def process_payment_receipt(image_path, name):
+def process_payment_receipt(image, name):
     """
     Extracts the total amount from an English receipt image and checks for a specific name.
     
     Args:
-        image_path: The path to the image file. If None, a photo will be taken.
+        image: The receipt image as bytes, a file-like object or a path.
         name: The name to search for in the receipt text.
         
     Returns:
         tuple: A tuple containing the extracted amount (or an error message) and a boolean indicating if the name was found.
     """
     try:
-        image = preprocess_image(image_path)
+        image = preprocess_image(image)
         
         # Perform OCR
-        text = pytesseract.image_to_string(image, lang='eng', config="--psm 6")
-        
-        # Search for the amount near keywords
-        amount_match = re.search(r"(Total|Amount|TOTAL|AMOUNT):?\s*\$?(\d{1,3}(?:,\d{3})*(?:\.\d{2})?)", text, re.IGNORECASE)
-        amount = amount_match.group(2) if amount_match else None
-        
-        # Check if the name is found in the text
-        name_found = name.lower() in text.lower()
-        
-        if amount is None:
-            return None, name_found
-
-        return amount, name_found
+        text = ocr_image(image)
+        return parse_payment_text(text, name)
 
     except Exception as e:
         return f"Error processing the image: {str(e)}", False
-    finally:
-        # Cleanup temporary file if created
-        if image_path and os.path.exists(image_path) and not os.path.isabs(image_path):
-            os.remove(image_path)
+
+
+def extract_amount(text):
+    """Find the total amount in the OCR text of a payment receipt, or None."""
+    return receipt_parser.parse(text, "payment")["amount"]
+
+
+def parse_payment_text(text, name):
+    """
+    Extracts the total amount from the OCR text of a payment receipt and checks for a specific name.
+
+    Returns:
+        tuple: The amount (or None) and whether the name was found.
+    """
+    return extract_amount(text), receipt_parser.contains_name(text, name)
+
+
+def scan_image(image, timings=None):
+    """
+    Run OCR on a receipt image.
+
+    This is what the OCR job workers run, and what the OCR cache stores. The
+    text is parsed afterwards, with the grammar the request asked for.
+
+    Args:
+        timings (dict): If given, receives the seconds spent per stage:
+            loading, each preprocessing stage and OCR.
+
+    Returns:
+        dict: The raw OCR "text".
+
+    Raises:
+        InvalidImage: If the image can't be decoded.
+    """
+    timings = {} if timings is None else timings
+    start = time.perf_counter()
+    try:
+        image = load_image(image)
+        PREPROCESSOR.draft(image)
+        image.load()  # Decode now, so the time counts as loading
+    except (OSError, SyntaxError, ValueError, Image.DecompressionBombError) as e:
+        # UnidentifiedImageError and truncated files are OSErrors; some decoders raise the others
+        raise InvalidImage(f"The upload is not a readable image ({type(e).__name__}).") from None
+    timings["load"] = time.perf_counter() - start
+
+    image = preprocess_image(image, timings)
+    start = time.perf_counter()
+    text = ocr_image(image)
+    timings["ocr"] = time.perf_counter() - start
+    return {"text": text}